@@ -0,0 +1,80 @@
+"""
+Gemini explicit context caching for long document texts
+"""
+
+import asyncio
+import datetime
+import hashlib
+import logging
+from typing import Optional, Tuple
+
+import google.generativeai as genai
+from google.generativeai import caching
+
+from config import config
+from ai.dynamic_prompts import CACHED_DOCUMENT_REFERENCE
+from ai.executors import gemini_executor
+from ai.response_cache import LRUCache, gemini_inflight
+
+logger = logging.getLogger(__name__)
+
+# Cached contexts by document hash; expire locally a little before Gemini drops them
+_context_caches = LRUCache(
+    maxsize=config.GEMINI_CONTEXT_CACHE_SIZE,
+    ttl=max(config.GEMINI_CONTEXT_CACHE_TTL_MIN * 60 - 30, 1)
+)
+
+
+def document_key(document_text: str) -> str:
+    """Hash document text into the key identifying its cached context"""
+    return hashlib.blake2b(document_text.encode(), digest_size=16).hexdigest()
+
+
+async def _create_context_cache(document_text: str) -> Optional[caching.CachedContent]:
+    """Upload document text as Gemini cached context (None on failure)"""
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            gemini_executor,
+            lambda: caching.CachedContent.create(
+                model=config.GEMINI_CONTEXT_CACHE_MODEL,
+                contents=[document_text],
+                ttl=datetime.timedelta(minutes=config.GEMINI_CONTEXT_CACHE_TTL_MIN)
+            )
+        )
+    except Exception as e:
+        logger.warning("Context cache creation failed, sending document inline: %s", e)
+        return None
+
+
+async def get_document_context(
+    document_text: str
+) -> Tuple[Optional[genai.GenerativeModel], str, str]:
+    """
+    Bind long document text to a shared Gemini cached context.
+    Returns (model, prompt_text, context_key): a model reading the cached context,
+    the text to put in prompts in place of the document, and the response cache key
+    suffix. Short documents (or failures) get (None, document_text, "").
+    """
+    if not config.GEMINI_CONTEXT_CACHE_ENABLED:
+        return None, document_text, ""
+    if len(document_text) < config.GEMINI_CONTEXT_CACHE_MIN_CHARS:
+        return None, document_text, ""
+
+    key = document_key(document_text)
+    context_cache = _context_caches.get(key)
+    if context_cache is None:
+        async def create() -> Optional[caching.CachedContent]:
+            created = await _create_context_cache(document_text)
+            if created is not None:
+                _context_caches.set(key, created)
+            return created
+
+        # Concurrent first requests for a document share one (billed) cached context
+        context_cache = await gemini_inflight.run(f"context:{key}", create)
+        if context_cache is None:
+            return None, document_text, ""
+
+    logger.debug("Using cached context %s", context_cache.name)
+    model = genai.GenerativeModel.from_cached_content(cached_content=context_cache)
+    return model, CACHED_DOCUMENT_REFERENCE, key
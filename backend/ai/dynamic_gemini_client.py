@@ -3,19 +3,78 @@ Enhanced Gemini client with dynamic document analysis workflow
 """
 
 import asyncio
-from typing import Dict, Any, List
+import hashlib
+import itertools
+import logging
+import re
+import threading
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 import google.generativeai as genai
+import orjson
 
 from config import config
 from ai.dynamic_prompts import (
-    get_document_type_prompt,
-    get_generic_analysis_prompts,
-    get_document_specific_prompts,
+    COMBINED_ANALYSIS_SCHEMA,
+    SPECIFIC_ANALYSIS_SCHEMA,
+    get_combined_analysis_prompt,
+    get_combined_specific_prompt,
     get_qa_prompt
 )
 from ai.text_parser import InsightTextParser, ParsedInsight
+from ai.response_cache import (
+    LRUCache,
+    SemanticCache,
+    analysis_result_cache,
+    gemini_inflight,
+    gemini_response_cache,
+    semantic_analysis_cache
+)
+from ai.context_cache import get_document_context
+from ai.gemini_model import get_gemini_model
+from ai.executors import gemini_executor, gemini_rate_limiter, gemini_semaphore
 from utils.errors import AIServiceError
 
+logger = logging.getLogger(__name__)
+
+# Bump when the shape of analysis results changes to invalidate cached results
+ANALYSIS_SCHEMA_VERSION = 1
+
+# Used when the document type cannot be determined
+_FALLBACK_DOCUMENT_TYPE = {
+    'document_type': 'Legal Document',
+    'category': 'Legal',
+    'confidence': 'Low'
+}
+
+_HORIZONTAL_SPACE_RE = re.compile(r'[^\S\n]+')
+_LINE_BREAK_RE = re.compile(r' *\n\s*')
+
+# Preprocessed document texts keyed by content hash
+_preprocessed_documents = LRUCache(maxsize=64)
+
+# Answers keyed by (raw document hash, question), checked before any prompt preparation
+_qa_answers = LRUCache(maxsize=config.QA_CACHE_SIZE, ttl=config.QA_CACHE_TTL_SECONDS)
+
+# Per-document SemanticCache of answers keyed by question embedding, for rephrased questions
+_qa_semantic_answers = LRUCache(maxsize=config.SEMANTIC_CACHE_SIZE, ttl=config.QA_CACHE_TTL_SECONDS)
+_QA_SEMANTIC_ANSWERS_PER_DOCUMENT = 64
+
+
+def _preprocess_document(document_text: str) -> str:
+    """Collapse redundant whitespace and cap length before the text is embedded in prompts"""
+    key = hashlib.blake2b(document_text.encode(), digest_size=16).hexdigest()
+    cached_text = _preprocessed_documents.get(key)
+    if cached_text is not None:
+        return cached_text
+    
+    # Keep paragraph breaks, which help the model locate clauses
+    text = _HORIZONTAL_SPACE_RE.sub(' ', document_text)
+    text = _LINE_BREAK_RE.sub(lambda m: '\n\n' if m.group().count('\n') > 1 else '\n', text).strip()
+    text = text[:config.MAX_DOC_CHARS]
+    
+    _preprocessed_documents.set(key, text)
+    return text
+
 
 class DynamicGeminiClient:
     """Enhanced Gemini client with intelligent document analysis workflow"""
@@ -26,49 +85,161 @@ class DynamicGeminiClient:
             raise AIServiceError("Gemini API key not configured")
         
         try:
-            genai.configure(api_key=config.GEMINI_API_KEY)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+            self.model = get_gemini_model()
             self.parser = InsightTextParser()
         except Exception as e:
             raise AIServiceError(f"Failed to initialize Gemini client: {str(e)}")
 
+    def _cache_key(self, prompt: str, context_key: str = "") -> str:
+        """Build the response cache key from model name, cached context and prompt"""
+        payload = f"{self.model.model_name}\n{context_key}\n{prompt}".encode()
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def _result_cache_key(self, document_text: str) -> str:
+        """Build the analysis result cache key from schema version, model name and document"""
+        digest = hashlib.blake2b(document_text.encode(), digest_size=16).hexdigest()
+        return f"v{ANALYSIS_SCHEMA_VERSION}:{self.model.model_name}:{digest}"
+
+    async def _cached_generate(
+        self,
+        prompt: str,
+        model: Optional[genai.GenerativeModel] = None,
+        context_key: str = "",
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        Generate content for a prompt, serving repeated prompts from cache.
+        `model` may be bound to cached document context identified by `context_key`;
+        `response_schema` switches Gemini to JSON mode with that schema.
+        """
+        key = self._cache_key(prompt, context_key)
+        cached_text = await gemini_response_cache.get(key)
+        if cached_text is not None:
+            logger.debug("Response cache hit for %s", key)
+            return cached_text
+
+        generation_config = None
+        if response_schema is not None:
+            generation_config = {
+                "response_mime_type": "application/json",
+                "response_schema": response_schema
+            }
+
+        async def generate() -> str:
+            async with gemini_rate_limiter, gemini_semaphore:
+                response = await (model or self.model).generate_content_async(
+                    prompt, generation_config=generation_config
+                )
+            await gemini_response_cache.set(key, response.text)
+            return response.text
+
+        # Concurrent callers with the same prompt share one request
+        return await gemini_inflight.run(key, generate)
+
+    async def _embed(self, content: Any) -> Optional[Any]:
+        """Embed a text or a list of texts (one batch request) for the semantic caches (None if embedding fails)"""
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                gemini_executor,
+                lambda: genai.embed_content(
+                    model=config.EMBEDDING_MODEL,
+                    content=content,
+                    task_type="semantic_similarity"
+                )
+            )
+            return result["embedding"]
+        except Exception as e:
+            logger.warning("Embedding failed: %s", e)
+            return None
+
+    async def _embed_text(self, text: str) -> Optional[List[List[float]]]:
+        """Embed a short text (a question) as a single chunk"""
+        embedding = await self._embed(text[:config.EMBEDDING_MAX_CHARS])
+        return [embedding] if embedding is not None else None
+
+    async def _embed_document(self, document_text: str) -> Optional[List[List[float]]]:
+        """
+        Embed a whole document chunk by chunk, so documents sharing an opening (e.g. one
+        template) still differ where their later terms do. Past EMBEDDING_MAX_CHUNKS chunks,
+        chunks are taken evenly across the document.
+        """
+        size = config.EMBEDDING_MAX_CHARS
+        chunks = [document_text[start:start + size] for start in range(0, len(document_text), size)]
+        limit = max(2, config.EMBEDDING_MAX_CHUNKS)
+        if len(chunks) > limit:
+            step = (len(chunks) - 1) / (limit - 1)
+            chunks = [chunks[round(i * step)] for i in range(limit)]
+        if not chunks:
+            return None
+        return await self._embed(chunks)
+
+    async def _run_analysis_stages(
+        self,
+        document_text: str
+    ) -> Tuple[Dict[str, str], List[ParsedInsight], List[ParsedInsight]]:
+        """Run type detection, generic and specific analysis, sharing cached context when possible"""
+        model, prompt_text, context_key = await get_document_context(document_text)
+        
+        # Steps 1 & 2: Detect document type and answer generic questions in one call
+        doc_type_info, generic_insights = await self._run_combined_analysis(
+            prompt_text, model, context_key
+        )
+        logger.debug("Detected document type: %s", doc_type_info)
+        
+        # Step 3: Ask the questions matching the detected type in a second call
+        specific_insights = await self._run_specific_analysis(
+            doc_type_info['document_type'], prompt_text, model, context_key
+        )
+        return doc_type_info, generic_insights, specific_insights
+
     async def analyze_document_dynamic(self, doc_id: str, document_text: str) -> Dict[str, Any]:
         """
         Comprehensive document analysis using dynamic workflow:
         1. Detect document type
-        2. Ask generic questions
-        3. Ask document-specific questions
+        2. Ask generic questions (batched with step 1 in one JSON-mode call)
+        3. Ask document-specific questions (one JSON-mode call)
         4. Parse and structure responses
         """
         try:
-            print(f"DEBUG: Starting dynamic analysis for document {doc_id}")
+            logger.debug("Starting dynamic analysis for document %s", doc_id)
+            document_text = _preprocess_document(document_text)
             
-            # Step 1: Detect document type
-            doc_type_info = await self._detect_document_type(document_text)
-            print(f"DEBUG: Detected document type: {doc_type_info}")
+            # Serve repeat analyses of the same document text from the result cache
+            result_key = self._result_cache_key(document_text)
+            cached_json = await analysis_result_cache.get(result_key)
+            if cached_json is not None:
+                logger.debug("Analysis cache hit for document %s", doc_id)
+                return orjson.loads(cached_json) | {"doc_id": doc_id}
             
-            # Step 2: Run generic analysis
-            generic_insights = await self._run_generic_analysis(document_text)
-            print(f"DEBUG: Generated {len(generic_insights)} generic insights")
+            # Reuse the analysis of a near-identical document if available
+            embedding = None
+            if config.SEMANTIC_CACHE_ENABLED:
+                embedding = await self._embed_document(document_text)
+                if embedding is not None:
+                    cached_result = semantic_analysis_cache.lookup(embedding)
+                    if cached_result is not None:
+                        logger.debug("Semantic cache hit for document %s", doc_id)
+                        cached_result["doc_id"] = doc_id
+                        return cached_result
             
-            # Step 3: Run document-specific analysis
-            specific_insights = await self._run_specific_analysis(
-                doc_type_info['document_type'], document_text
+            # Steps 1-3: Type detection, generic and document-specific analysis
+            doc_type_info, generic_insights, specific_insights = await self._run_analysis_stages(
+                document_text
             )
-            print(f"DEBUG: Generated {len(specific_insights)} specific insights")
-            
-            # Step 4: Combine and format results
-            all_insights = generic_insights + specific_insights
+            logger.debug("Generated %d generic insights", len(generic_insights))
+            logger.debug("Generated %d specific insights", len(specific_insights))
             
-            # Convert ParsedInsight objects to the expected format
-            formatted_insights = []
-            for insight in all_insights:
-                formatted_insights.append({
+            # Step 4: Combine results, converting ParsedInsight objects to the expected format
+            formatted_insights = [
+                {
                     "type_of_insight": insight.type,
                     "description": insight.description,
                     "intensity": insight.intensity.lower(),
                     "recommendation": insight.recommendation
-                })
+                }
+                for insight in itertools.chain(generic_insights, specific_insights)
+            ]
             
             # Ensure we have insights
             if not formatted_insights:
@@ -91,138 +262,129 @@ class DynamicGeminiClient:
                 "analysis_method": "dynamic_workflow"
             }
             
-            print(f"DEBUG: Final analysis contains {len(formatted_insights)} total insights")
+            if embedding is not None:
+                semantic_analysis_cache.add(embedding, analysis_result)
+            await analysis_result_cache.set(result_key, orjson.dumps(analysis_result).decode())
+            
+            logger.debug("Final analysis contains %d total insights", len(formatted_insights))
             return analysis_result
             
         except Exception as e:
-            print(f"DEBUG: Dynamic analysis failed: {str(e)}")
+            logger.warning("Dynamic analysis failed: %s", e)
             raise AIServiceError(f"Error in dynamic document analysis: {str(e)}")
 
-    async def _detect_document_type(self, document_text: str) -> Dict[str, str]:
-        """Step 1: Detect document type"""
+    async def _run_combined_analysis(
+        self,
+        document_text: str,
+        model: Optional[genai.GenerativeModel] = None,
+        context_key: str = ""
+    ) -> Tuple[Dict[str, str], List[ParsedInsight]]:
+        """Steps 1 & 2: Detect document type and run generic analysis in a single call"""
         try:
-            prompt = get_document_type_prompt(document_text)
-            
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.model.generate_content(prompt)
-            )
-            
-            response_text = response.text.strip()
-            print(f"DEBUG: Document type detection response: {response_text[:200]}...")
-            
-            return self.parser.parse_document_type(response_text)
-            
+            prompt = get_combined_analysis_prompt(document_text)
+            response_text = (await self._cached_generate(
+                prompt, model, context_key, COMBINED_ANALYSIS_SCHEMA
+            )).strip()
+            logger.debug("Combined analysis response length: %d", len(response_text))
         except Exception as e:
-            print(f"DEBUG: Document type detection failed: {str(e)}")
-            return {
-                'document_type': 'Legal Document',
-                'category': 'Legal',
-                'confidence': 'Low'
-            }
-
-    async def _run_generic_analysis(self, document_text: str) -> List[ParsedInsight]:
-        """Step 2: Run generic analysis questions"""
-        insights = []
+            logger.warning("Combined analysis failed: %s", e)
+            return dict(_FALLBACK_DOCUMENT_TYPE), []
         
         try:
-            generic_prompts = get_generic_analysis_prompts(document_text)
-            print(f"DEBUG: Running {len(generic_prompts)} generic analysis prompts")
-            
-            # Run prompts concurrently
-            loop = asyncio.get_event_loop()
-            tasks = []
-            
-            for i, prompt in enumerate(generic_prompts):
-                task = loop.run_in_executor(
-                    None,
-                    lambda p=prompt: self.model.generate_content(p)
-                )
-                tasks.append((i, task))
-            
-            # Process responses
-            for i, task in tasks:
-                try:
-                    response = await task
-                    response_text = response.text.strip()
-                    print(f"DEBUG: Generic prompt {i} response length: {len(response_text)}")
-                    
-                    # Determine default type based on prompt index
-                    default_types = ['risk', 'compliance', 'suggestion']
-                    default_type = default_types[i] if i < len(default_types) else 'suggestion'
-                    
-                    prompt_insights = self.parser.parse_insights_from_text(response_text, default_type)
-                    insights.extend(prompt_insights)
-                    print(f"DEBUG: Extracted {len(prompt_insights)} insights from generic prompt {i}")
-                    
-                except Exception as e:
-                    print(f"DEBUG: Generic prompt {i} failed: {str(e)}")
-                    continue
-            
-            return insights
-            
-        except Exception as e:
-            print(f"DEBUG: Generic analysis failed: {str(e)}")
-            return []
-
-    async def _run_specific_analysis(self, document_type: str, document_text: str) -> List[ParsedInsight]:
-        """Step 3: Run document-specific analysis"""
+            result = orjson.loads(response_text)
+        except orjson.JSONDecodeError as e:
+            # Fall back to free-text parsing if the model ignored JSON mode
+            logger.debug("Combined analysis returned invalid JSON: %s", e)
+            return (
+                self.parser.parse_document_type(response_text),
+                self.parser.parse_insights_from_text(response_text, 'suggestion')
+            )
+        
+        doc_type = result.get('document_type') or {}
+        doc_type_info = {
+            'document_type': doc_type.get('document_type') or _FALLBACK_DOCUMENT_TYPE['document_type'],
+            'category': doc_type.get('category') or _FALLBACK_DOCUMENT_TYPE['category'],
+            'confidence': (doc_type.get('confidence') or _FALLBACK_DOCUMENT_TYPE['confidence']).title()
+        }
+        
         insights = []
+        for section, insight_type in (('risks', 'risk'), ('compliance', 'compliance'), ('suggestions', 'suggestion')):
+            section_insights = self.parser.parse_structured_insights(result.get(section), insight_type)
+            insights.extend(section_insights)
+            logger.debug("Extracted %d %s insights", len(section_insights), section)
         
+        return doc_type_info, insights
+
+    async def _run_specific_analysis(
+        self,
+        document_type: str,
+        document_text: str,
+        model: Optional[genai.GenerativeModel] = None,
+        context_key: str = ""
+    ) -> List[ParsedInsight]:
+        """Step 3: Run document-specific analysis"""
         try:
-            specific_prompts = get_document_specific_prompts(document_type, document_text)
-            print(f"DEBUG: Running {len(specific_prompts)} document-specific prompts for type: {document_type}")
-            
-            # Run prompts concurrently (limit to 3 for performance)
-            loop = asyncio.get_event_loop()
-            tasks = []
-            
-            for i, prompt in enumerate(specific_prompts[:3]):  # Limit to 3 specific questions
-                task = loop.run_in_executor(
-                    None,
-                    lambda p=prompt: self.model.generate_content(p)
-                )
-                tasks.append((i, task))
-            
-            # Process responses
-            for i, task in tasks:
-                try:
-                    response = await task
-                    response_text = response.text.strip()
-                    print(f"DEBUG: Specific prompt {i} response length: {len(response_text)}")
-                    
-                    prompt_insights = self.parser.parse_insights_from_text(response_text, 'analysis')
-                    insights.extend(prompt_insights)
-                    print(f"DEBUG: Extracted {len(prompt_insights)} insights from specific prompt {i}")
-                    
-                except Exception as e:
-                    print(f"DEBUG: Specific prompt {i} failed: {str(e)}")
-                    continue
-            
-            return insights
+            prompt = get_combined_specific_prompt(document_type, document_text)
+            logger.debug("Running document-specific analysis for type: %s", document_type)
             
+            response_text = (await self._cached_generate(
+                prompt, model, context_key, SPECIFIC_ANALYSIS_SCHEMA
+            )).strip()
+            logger.debug("Specific analysis response length: %d", len(response_text))
         except Exception as e:
-            print(f"DEBUG: Specific analysis failed: {str(e)}")
+            logger.warning("Specific analysis failed: %s", e)
             return []
+        
+        try:
+            result = orjson.loads(response_text)
+        except orjson.JSONDecodeError as e:
+            logger.debug("Specific analysis returned invalid JSON: %s", e)
+            return self.parser.parse_insights_from_text(response_text, 'analysis')
+        
+        insights = self.parser.parse_structured_insights(result.get('specific'), 'analysis')
+        logger.debug("Extracted %d specific insights", len(insights))
+        return insights
 
     async def answer_question(self, doc_id: str, document_text: str, question: str) -> Dict[str, Any]:
         """
-        Answer a question about the document (unchanged)
+        Answer a question about the document
         """
         try:
-            # Prepare the prompt
-            prompt = get_qa_prompt(document_text, question)
+            document_digest = hashlib.blake2b(document_text.encode(), digest_size=16).digest()
+            qa_key = (document_digest, question)
+            answer = _qa_answers.get(qa_key)
             
-            # Generate content
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.model.generate_content(prompt)
-            )
+            # A rephrasing of a question already answered for this document reuses that answer
+            embedding = None
+            if answer is None and config.SEMANTIC_CACHE_ENABLED:
+                embedding = await self._embed_text(question)
+                question_cache = _qa_semantic_answers.get(document_digest)
+                if embedding is not None and question_cache is not None:
+                    answer = question_cache.lookup(embedding)
+                    if answer is not None:
+                        logger.debug("Semantic Q&A cache hit for document %s", doc_id)
+                        _qa_answers.set(qa_key, answer)
             
-            # Extract answer
-            answer = response.text.strip()
+            if answer is None:
+                # Long documents are read from shared cached context; the prompt carries the question.
+                # Preprocessing matches analyze_document_dynamic so both share the same context.
+                document_text = _preprocess_document(document_text)
+                model, prompt_text, context_key = await get_document_context(document_text)
+                prompt = get_qa_prompt(prompt_text, question)
+                
+                # Generate content (served from cache for repeated questions)
+                answer = (await self._cached_generate(prompt, model, context_key)).strip()
+                _qa_answers.set(qa_key, answer)
+                
+                if embedding is not None:
+                    question_cache = _qa_semantic_answers.get(document_digest)
+                    if question_cache is None:
+                        question_cache = SemanticCache(
+                            threshold=config.SEMANTIC_CACHE_THRESHOLD,
+                            maxsize=_QA_SEMANTIC_ANSWERS_PER_DOCUMENT
+                        )
+                        _qa_semantic_answers.set(document_digest, question_cache)
+                    question_cache.add(embedding, answer)
             
             return {
                 "doc_id": doc_id,
@@ -233,10 +395,58 @@ class DynamicGeminiClient:
         except Exception as e:
             raise AIServiceError(f"Error answering question with Gemini: {str(e)}")
 
+    async def stream_answer(self, doc_id: str, document_text: str, question: str) -> AsyncIterator[str]:
+        """
+        Answer a question about the document, yielding text chunks as Gemini produces them
+        """
+        document_text = _preprocess_document(document_text)
+        model, prompt_text, context_key = await get_document_context(document_text)
+        prompt = get_qa_prompt(prompt_text, question)
+        
+        key = self._cache_key(prompt, context_key)
+        cached_text = await gemini_response_cache.get(key)
+        if cached_text is not None:
+            logger.debug("Response cache hit for %s", key)
+            yield cached_text.strip()
+            return
+        
+        chunks = []
+        try:
+            async with gemini_rate_limiter, gemini_semaphore:
+                response = await (model or self.model).generate_content_async(prompt, stream=True)
+                async for chunk in response:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+        except Exception as e:
+            raise AIServiceError(f"Error answering question with Gemini: {str(e)}")
+        
+        # Completed streams serve later answer_question calls for the same question
+        await gemini_response_cache.set(key, "".join(chunks))
+
     def generate_content_sync(self, prompt: str) -> str:
         """Synchronous content generation (for testing)"""
         try:
+            key = self._cache_key(prompt)
+            cached_text = gemini_response_cache.memory.get(key)
+            if cached_text is not None:
+                return cached_text.strip()
+            
             response = self.model.generate_content(prompt)
+            gemini_response_cache.memory.set(key, response.text)
             return response.text.strip()
         except Exception as e:
-            raise AIServiceError(f"Error generating content: {str(e)}")
\ No newline at end of file
+            raise AIServiceError(f"Error generating content: {str(e)}")
+
+
+_gemini_client: Optional[DynamicGeminiClient] = None
+_gemini_client_lock = threading.Lock()
+
+
+def get_gemini_client() -> DynamicGeminiClient:
+    """Return the shared DynamicGeminiClient; it holds no per-request state"""
+    global _gemini_client
+    if _gemini_client is None:
+        with _gemini_client_lock:
+            if _gemini_client is None:
+                _gemini_client = DynamicGeminiClient()
+    return _gemini_client
@@ -0,0 +1,45 @@
+"""
+Dedicated thread pools and shared concurrency limits for AI service calls
+"""
+
+import asyncio
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from aiolimiter import AsyncLimiter
+
+from config import config
+
+
+# Blocking Gemini SDK calls run here instead of the loop's default executor,
+# so they never queue behind (or starve) unrelated run_in_executor users
+gemini_executor = ThreadPoolExecutor(
+    max_workers=config.GEMINI_POOL_SIZE,
+    thread_name_prefix="gemini-io"
+)
+
+# Blocking Vision OCR calls and OCR file reads
+ocr_executor = ThreadPoolExecutor(
+    max_workers=config.OCR_CONCURRENCY,
+    thread_name_prefix="ocr-io"
+)
+
+# CPU-bound document work (upload parsing, PDF page rasterization), one pool so the two
+# never oversubscribe the cores; spawned (not forked) so workers never inherit gRPC state
+cpu_executor = ProcessPoolExecutor(
+    max_workers=config.CPU_WORKER_PROCESSES,
+    mp_context=multiprocessing.get_context("spawn")
+)
+
+atexit.register(gemini_executor.shutdown, wait=False)
+atexit.register(ocr_executor.shutdown, wait=False)
+atexit.register(cpu_executor.shutdown, wait=False)
+
+# Shared across clients so concurrent requests respect the same bounds
+gemini_semaphore = asyncio.Semaphore(config.GEMINI_MAX_CONCURRENCY)
+# Throttle slightly under the quota to absorb the limiter's initial burst
+gemini_rate_limiter = AsyncLimiter(0.95 * config.GEMINI_RPM, 60)
+
+# Vision images per minute across all OCR jobs
+vision_rate_limiter = AsyncLimiter(0.95 * config.VISION_RPM, 60)
\ No newline at end of file
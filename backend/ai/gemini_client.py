@@ -2,10 +2,13 @@
 Google Gemini API client for document analysis and Q&A
 """
 
-import json
 import asyncio
-from typing import Dict, Any
+import copy
+import hashlib
+import logging
+from typing import Dict, Any, List, Optional, Tuple, Union
 import google.generativeai as genai
+import orjson
 
 from config import config
 from ai.prompts import (
@@ -15,8 +18,35 @@ from ai.prompts import (
     get_risk_assessment_prompt,
     get_qa_prompt
 )
+from ai.context_cache import get_document_context
+from ai.gemini_model import get_gemini_model
+from ai.executors import gemini_rate_limiter, gemini_semaphore
+from ai.response_cache import LRUCache, gemini_inflight
 from utils.errors import AIServiceError
 
+logger = logging.getLogger(__name__)
+
+# Sub-prompt result keys and their prompt builders, in the order the prompts are sent
+PROMPT_ORDER = ("clauses", "document_type", "parties", "risks")
+PROMPT_BUILDERS = (
+    get_clauses_prompt,
+    get_document_type_prompt,
+    get_parties_prompt,
+    get_risk_assessment_prompt
+)
+
+# Results used when a sub-prompt response is not valid JSON, aligned with PROMPT_ORDER
+PROMPT_FALLBACKS = (
+    {"clause_count": 1, "clause_types": ["general"]},
+    {"document_type": "Legal Document", "document_category": "Contract", "confidence_score": 0.7},
+    {"party_count": 2, "relationship_type": "contractual"},
+    {"risk_level": "medium", "risks": [{"severity": "medium", "description": "Standard contractual risks identified", "recommendation": "Review terms carefully"}], "compliance_issues": []}
+)
+
+# Severities at which risk assessment items are surfaced as insights
+REPORTED_RISK_SEVERITIES = frozenset({"high", "critical"})
+REPORTED_COMPLIANCE_SEVERITIES = frozenset({"medium", "high"})
+
 
 class GeminiClient:
     """Google Gemini API client"""
@@ -27,71 +57,93 @@ class GeminiClient:
             raise AIServiceError("Gemini API key not configured")
         
         try:
-            genai.configure(api_key=config.GEMINI_API_KEY)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+            self.model = get_gemini_model()
         except Exception as e:
             raise AIServiceError(f"Failed to initialize Gemini client: {str(e)}")
+        
+        # Results for repeated documents and questions
+        self._analyze_cache = LRUCache(config.ANALYZE_CACHE_SIZE, config.RESPONSE_CACHE_TTL_SECONDS)
+        self._qa_cache = LRUCache(config.QA_CACHE_SIZE, config.RESPONSE_CACHE_TTL_SECONDS)
+    
+    def _text_hash(self, *parts: str) -> str:
+        """Hash the model name and text parts into a cache key"""
+        digest = hashlib.blake2b(self.model.model_name.encode(), digest_size=16)
+        for part in parts:
+            digest.update(b"\0" + part.encode())
+        return digest.hexdigest()
+    
+    def clear_caches(self) -> None:
+        """Drop cached analyses and answers"""
+        self._analyze_cache.clear()
+        self._qa_cache.clear()
+    
+    async def _generate(
+        self,
+        prompt: str,
+        model: Optional[genai.GenerativeModel] = None,
+        context_key: str = "",
+        json_mode: bool = False
+    ):
+        """
+        Generate content within the shared rate limit and concurrency bound.
+        Concurrent identical prompts (for the same cached context) share one request.
+        `json_mode` makes Gemini answer with bare JSON (no markdown fences or prose).
+        """
+        generation_config = {"response_mime_type": "application/json"} if json_mode else None
+        
+        async def generate():
+            async with gemini_rate_limiter, gemini_semaphore:
+                return await (model or self.model).generate_content_async(
+                    prompt, generation_config=generation_config
+                )
+        
+        key = self._text_hash(context_key, prompt, "json" if json_mode else "text")
+        return await gemini_inflight.run(key, generate)
     
     async def analyze_document(self, doc_id: str, document_text: str) -> Dict[str, Any]:
         """
         Analyze document using multiple targeted prompts
         Returns aggregated structured JSON response
         """
+        cache_key = self._text_hash(document_text)
+        cached_result = self._analyze_cache.get(cache_key)
+        if cached_result is not None:
+            logger.debug("Analysis cache hit for document %s", doc_id)
+            return copy.deepcopy(cached_result) | {"doc_id": doc_id}
+        
         try:
-            # Run multiple prompts concurrently
-            prompts = {
-                "clauses": get_clauses_prompt(document_text),
-                "document_type": get_document_type_prompt(document_text),
-                "parties": get_parties_prompt(document_text),
-                "risks": get_risk_assessment_prompt(document_text)
-            }
-            
             # Execute all prompts concurrently
-            loop = asyncio.get_event_loop()
-            tasks = []
-            
-            for prompt_type, prompt in prompts.items():
-                task = loop.run_in_executor(
-                    None,
-                    lambda p=prompt: self.model.generate_content(p)
-                )
-                tasks.append((prompt_type, task))
+            responses = await asyncio.gather(
+                *(self._generate(build(document_text), json_mode=True) for build in PROMPT_BUILDERS),
+                return_exceptions=True
+            )
             
-            # Wait for all responses
             results = {}
-            for prompt_type, task in tasks:
+            for prompt_type, fallback, response in zip(PROMPT_ORDER, PROMPT_FALLBACKS, responses):
+                if isinstance(response, Exception):
+                    logger.warning("Complete failure for %s: %s", prompt_type, response)
+                    results[prompt_type] = {
+                        "error": f"Analysis failed: {str(response)}",
+                        "raw_response": ""
+                    }
+                    continue
+                
                 try:
-                    response = await task
-                    response_text = response.text.strip()
-                    
-                    # Clean up response text - remove markdown code blocks if present
-                    if response_text.startswith('```json'):
-                        response_text = response_text.replace('```json', '').replace('```', '').strip()
-                    elif response_text.startswith('```'):
-                        response_text = response_text.replace('```', '').strip()
+                    # JSON mode returns the object itself, with no markdown fences to strip
+                    response_text = response.text
                     
                     # Try to parse JSON response
                     try:
-                        parsed_result = json.loads(response_text)
-                        results[prompt_type] = parsed_result
-                        print(f"DEBUG: Successfully parsed {prompt_type}")
-                    except json.JSONDecodeError as e:
+                        results[prompt_type] = orjson.loads(response_text)
+                        logger.debug("Successfully parsed %s", prompt_type)
+                    except orjson.JSONDecodeError as e:
                         # More robust fallback - try to extract useful info even from bad JSON
-                        print(f"DEBUG: JSON parsing failed for {prompt_type}: {str(e)}")
-                        print(f"DEBUG: Raw response was: {response_text[:200]}...")
-                        
-                        # Create fallback based on prompt type
-                        if prompt_type == "clauses":
-                            results[prompt_type] = {"clause_count": 1, "clause_types": ["general"]}
-                        elif prompt_type == "document_type":
-                            results[prompt_type] = {"document_type": "Legal Document", "document_category": "Contract", "confidence_score": 0.7}
-                        elif prompt_type == "parties":
-                            results[prompt_type] = {"party_count": 2, "relationship_type": "contractual"}
-                        elif prompt_type == "risks":
-                            results[prompt_type] = {"risk_level": "medium", "risks": [{"severity": "medium", "description": "Standard contractual risks identified", "recommendation": "Review terms carefully"}], "compliance_issues": []}
+                        logger.warning("JSON parsing failed for %s: %s", prompt_type, e)
+                        logger.debug("Raw response was: %s", response_text)
+                        results[prompt_type] = copy.deepcopy(fallback)
                         
                 except Exception as e:
-                    print(f"DEBUG: Complete failure for {prompt_type}: {str(e)}")
+                    logger.warning("Complete failure for %s: %s", prompt_type, e)
                     results[prompt_type] = {
                         "error": f"Analysis failed: {str(e)}",
                         "raw_response": ""
@@ -100,13 +152,19 @@ class GeminiClient:
             # Aggregate results into insights format for frontend compatibility
             insights = self._aggregate_results_to_insights(results)
             
-            return {
+            analysis_result = {
                 "doc_id": doc_id,
                 "insights": insights,
                 "detailed_analysis": results,  # Include raw results for debugging
-                "analysis_timestamp": asyncio.get_event_loop().time()
+                "analysis_timestamp": asyncio.get_running_loop().time()
             }
             
+            # Don't cache partial failures so the next request retries them
+            if not any("error" in result for result in results.values()):
+                self._analyze_cache.set(cache_key, copy.deepcopy(analysis_result))
+            
+            return analysis_result
+            
         except Exception as e:
             raise AIServiceError(f"Error analyzing document with Gemini: {str(e)}")
     
@@ -115,12 +173,12 @@ class GeminiClient:
         insights = []
         
         # Debug logging
-        print(f"DEBUG: Aggregating results with keys: {list(results.keys())}")
+        logger.debug("Aggregating results with keys: %s", list(results.keys()))
         for key, value in results.items():
             if isinstance(value, dict) and "error" in value:
-                print(f"DEBUG: {key} has error: {value['error']}")
+                logger.debug("%s has error: %s", key, value['error'])
             else:
-                print(f"DEBUG: {key} successful with keys: {list(value.keys()) if isinstance(value, dict) else 'not dict'}")
+                logger.debug("%s successful with keys: %s", key, list(value.keys()) if isinstance(value, dict) else 'not dict')
         
         # Process clauses analysis
         if "clauses" in results and "error" not in results["clauses"]:
@@ -132,9 +190,9 @@ class GeminiClient:
                 "intensity": "low",
                 "recommendation": "Review clause organization and ensure all necessary terms are covered"
             })
-            print(f"DEBUG: Added clauses insight")
+            logger.debug("Added clauses insight")
         else:
-            print(f"DEBUG: Skipping clauses - error: {'error' in results.get('clauses', {})}")
+            logger.debug("Skipping clauses - error: %s", 'error' in results.get('clauses', {}))
         
         # Process document type analysis
         if "document_type" in results and "error" not in results["document_type"]:
@@ -147,9 +205,9 @@ class GeminiClient:
                 "intensity": "low",
                 "recommendation": f"Ensure document follows {doc_type} best practices and legal requirements"
             })
-            print(f"DEBUG: Added document type insight")
+            logger.debug("Added document type insight")
         else:
-            print(f"DEBUG: Skipping document_type - error: {'error' in results.get('document_type', {})}")
+            logger.debug("Skipping document_type - error: %s", 'error' in results.get('document_type', {}))
         
         # Process parties analysis
         if "parties" in results and "error" not in results["parties"]:
@@ -162,9 +220,9 @@ class GeminiClient:
                 "intensity": "medium",
                 "recommendation": "Verify all parties' legal capacity and authority to enter into this agreement"
             })
-            print(f"DEBUG: Added parties insight")
+            logger.debug("Added parties insight")
         else:
-            print(f"DEBUG: Skipping parties - error: {'error' in results.get('parties', {})}")
+            logger.debug("Skipping parties - error: %s", 'error' in results.get('parties', {}))
         
         # Process risk assessment
         if "risks" in results and "error" not in results["risks"]:
@@ -175,7 +233,7 @@ class GeminiClient:
             
             # Add high-priority risks
             for risk in risks:
-                if risk.get("severity") in ["high", "critical"]:
+                if isinstance(risk, dict) and risk.get("severity") in REPORTED_RISK_SEVERITIES:
                     insights.append({
                         "type_of_insight": "risk",
                         "description": risk.get("description", "Unspecified risk identified"),
@@ -185,7 +243,7 @@ class GeminiClient:
             
             # Add compliance issues
             for issue in compliance_issues:
-                if issue.get("severity") in ["medium", "high"]:
+                if isinstance(issue, dict) and issue.get("severity") in REPORTED_COMPLIANCE_SEVERITIES:
                     insights.append({
                         "type_of_insight": "compliance_mismatch", 
                         "description": issue.get("issue", "Compliance issue identified"),
@@ -193,14 +251,14 @@ class GeminiClient:
                         "recommendation": f"Address compliance requirement: {issue.get('requirement', 'Review applicable regulations')}"
                     })
             
-            print(f"DEBUG: Added {len(risks)} risks and {len(compliance_issues)} compliance issues")
+            logger.debug("Added %d risks and %d compliance issues", len(risks), len(compliance_issues))
         else:
-            print(f"DEBUG: Skipping risks - error: {'error' in results.get('risks', {})}")
+            logger.debug("Skipping risks - error: %s", 'error' in results.get('risks', {}))
         
         # Ensure we have at least some insights
-        print(f"DEBUG: Total insights generated: {len(insights)}")
+        logger.debug("Total insights generated: %d", len(insights))
         if not insights:
-            print(f"DEBUG: No insights generated, adding fallback")
+            logger.debug("No insights generated, adding fallback")
             insights.append({
                 "type_of_insight": "suggestion",
                 "description": "Document analysis completed but no specific insights generated",
@@ -216,18 +274,20 @@ class GeminiClient:
         Returns structured response
         """
         try:
-            # Prepare the prompt
-            prompt = get_qa_prompt(document_text, question)
-            
-            # Generate content
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.model.generate_content(prompt)
-            )
+            cache_key = self._text_hash(document_text, question)
+            answer = self._qa_cache.get(cache_key)
             
-            # Extract answer
-            answer = response.text.strip()
+            if answer is None:
+                # Long documents are read from shared cached context; the prompt carries the question
+                model, prompt_text, context_key = await get_document_context(document_text)
+                prompt = get_qa_prompt(prompt_text, question)
+                
+                # Generate content
+                response = await self._generate(prompt, model, context_key)
+                
+                # Extract answer
+                answer = response.text.strip()
+                self._qa_cache.set(cache_key, answer)
             
             return {
                 "doc_id": doc_id,
@@ -238,6 +298,32 @@ class GeminiClient:
         except Exception as e:
             raise AIServiceError(f"Error answering question with Gemini: {str(e)}")
     
+    async def analyze_documents_batch(
+        self,
+        items: List[Tuple[str, str]]
+    ) -> List[Union[Dict[str, Any], AIServiceError]]:
+        """
+        Analyze several (doc_id, document_text) pairs concurrently
+        Results keep the input order; failed documents yield their AIServiceError
+        """
+        return await asyncio.gather(
+            *(self.analyze_document(doc_id, document_text) for doc_id, document_text in items),
+            return_exceptions=True
+        )
+    
+    async def answer_questions_batch(
+        self,
+        items: List[Tuple[str, str, str]]
+    ) -> List[Union[Dict[str, Any], AIServiceError]]:
+        """
+        Answer several (doc_id, document_text, question) triples concurrently
+        Results keep the input order; failed questions yield their AIServiceError
+        """
+        return await asyncio.gather(
+            *(self.answer_question(doc_id, document_text, question) for doc_id, document_text, question in items),
+            return_exceptions=True
+        )
+    
     def generate_content_sync(self, prompt: str) -> str:
         """Synchronous content generation (for testing)"""
         try:
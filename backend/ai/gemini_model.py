@@ -0,0 +1,26 @@
+"""
+Shared Gemini model instance for all clients
+"""
+
+import threading
+from typing import Optional
+
+import google.generativeai as genai
+
+from config import config
+
+GEMINI_MODEL_NAME = "gemini-1.5-flash"
+
+_model: Optional[genai.GenerativeModel] = None
+_model_lock = threading.Lock()
+
+
+def get_gemini_model() -> genai.GenerativeModel:
+    """Configure the SDK and build the shared model on first use"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                genai.configure(api_key=config.GEMINI_API_KEY)
+                _model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    return _model
@@ -0,0 +1,59 @@
+"""
+PDF page rendering for OCR (runs in worker processes, so keep imports light)
+"""
+
+import os
+from typing import Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from config import config
+
+# Page zoom for the configured render DPI (PDF user space is 72 DPI)
+_ZOOM = config.OCR_RENDER_DPI / 72
+_MAT = fitz.Matrix(_ZOOM, _ZOOM)
+
+# JPEG is several times smaller than PNG for rasterized pages and cheaper to encode
+_JPEG_QUALITY = 85
+
+# The document this worker process rendered last, reused while its pages keep coming
+_open_document: Optional[Tuple[Tuple[str, int], fitz.Document]] = None
+
+
+def render_page(page: fitz.Page) -> bytes:
+    """Render a PDF page to image bytes for OCR, capping the longest edge at OCR_MAX_EDGE_PX"""
+    longest_edge = max(page.rect.width, page.rect.height)
+    if longest_edge * _ZOOM > config.OCR_MAX_EDGE_PX:
+        # Oversized pages gain nothing past Vision's working resolution; shrink instead
+        zoom = config.OCR_MAX_EDGE_PX / longest_edge
+        matrix = fitz.Matrix(zoom, zoom)
+    else:
+        matrix = _MAT
+    pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csRGB, alpha=False)
+    return pix.tobytes("jpeg", jpg_quality=_JPEG_QUALITY)
+
+
+def _get_document(pdf_path: str) -> fitz.Document:
+    """Open a PDF once per worker process rather than once per page"""
+    global _open_document
+    stamp = (pdf_path, os.stat(pdf_path).st_mtime_ns)
+    if _open_document is not None and _open_document[0] == stamp:
+        return _open_document[1]
+
+    if _open_document is not None:
+        _open_document[1].close()
+    doc = fitz.open(pdf_path)
+    _open_document = (stamp, doc)
+    return doc
+
+
+def load_pdf_page(pdf_path: str, page_num: int) -> Tuple[str, Optional[bytes]]:
+    """
+    Return (embedded_text, None) for pages with a usable text layer,
+    otherwise ("", rendered_image) for pages that need OCR
+    """
+    page = _get_document(pdf_path).load_page(page_num)
+    embedded_text = page.get_text("text").strip()
+    if len(embedded_text) > config.OCR_SKIP_NATIVE_THRESHOLD:
+        return embedded_text, None
+    return "", render_page(page)
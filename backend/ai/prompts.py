@@ -2,6 +2,8 @@
 Prompt templates for Gemini API interactions
 """
 
+from string import Formatter
+
 # Multiple targeted prompts for detailed analysis
 CLAUSES_COUNT_PROMPT = """
 You are an AI legal document analyzer. Analyze the provided document and count the number of clauses/sections.
@@ -104,22 +106,39 @@ Question: {question}
 Provide a clear, accurate answer based only on the information in the document. If the answer cannot be found in the document, say "The information to answer this question is not available in the provided document."
 """
 
+def _split_template(template: str) -> tuple:
+    """Split a str.format template into its literal parts (braces unescaped) around each field"""
+    parts = [""]
+    for literal, field_name, _, _ in Formatter().parse(template):
+        parts[-1] += literal
+        if field_name is not None:
+            parts.append("")
+    return tuple(parts)
+
+# Templates are split once at import so each call is a plain concatenation
+# instead of a .format() pass over the full document text
+CLAUSES_PREFIX, CLAUSES_SUFFIX = _split_template(CLAUSES_COUNT_PROMPT)
+DOCUMENT_TYPE_PREFIX, DOCUMENT_TYPE_SUFFIX = _split_template(DOCUMENT_TYPE_PROMPT)
+PARTIES_PREFIX, PARTIES_SUFFIX = _split_template(PARTIES_ANALYSIS_PROMPT)
+RISK_ASSESSMENT_PREFIX, RISK_ASSESSMENT_SUFFIX = _split_template(RISK_ASSESSMENT_PROMPT)
+QA_PREFIX, QA_INFIX, QA_SUFFIX = _split_template(QA_PROMPT)
+
 def get_clauses_prompt(document_text: str) -> str:
     """Get formatted clauses analysis prompt"""
-    return CLAUSES_COUNT_PROMPT.format(document_text=document_text)
+    return f"{CLAUSES_PREFIX}{document_text}{CLAUSES_SUFFIX}"
 
 def get_document_type_prompt(document_text: str) -> str:
     """Get formatted document type prompt"""
-    return DOCUMENT_TYPE_PROMPT.format(document_text=document_text)
+    return f"{DOCUMENT_TYPE_PREFIX}{document_text}{DOCUMENT_TYPE_SUFFIX}"
 
 def get_parties_prompt(document_text: str) -> str:
     """Get formatted parties analysis prompt"""
-    return PARTIES_ANALYSIS_PROMPT.format(document_text=document_text)
+    return f"{PARTIES_PREFIX}{document_text}{PARTIES_SUFFIX}"
 
 def get_risk_assessment_prompt(document_text: str) -> str:
     """Get formatted risk assessment prompt"""
-    return RISK_ASSESSMENT_PROMPT.format(document_text=document_text)
+    return f"{RISK_ASSESSMENT_PREFIX}{document_text}{RISK_ASSESSMENT_SUFFIX}"
 
 def get_qa_prompt(document_text: str, question: str) -> str:
     """Get formatted Q&A prompt"""
-    return QA_PROMPT.format(document_text=document_text, question=question)
\ No newline at end of file
+    return f"{QA_PREFIX}{document_text}{QA_INFIX}{question}{QA_SUFFIX}"
\ No newline at end of file
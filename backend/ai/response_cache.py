@@ -0,0 +1,215 @@
+"""
+Response caching for Gemini API calls (in-process LRU with optional Redis tier)
+"""
+
+import asyncio
+import copy
+import logging
+import math
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import redis.asyncio as redis
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[int] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[Any]:
+        """Return the cached value or None on miss/expiry"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Any, value: Any) -> None:
+        """Store a value, evicting the least recently used entry when full"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop all cached entries"""
+        with self._lock:
+            self._data.clear()
+
+
+class ResponseCache:
+    """Two-tier text cache: in-process LRU first, then Redis (if configured)"""
+
+    def __init__(self, namespace: str, maxsize: int, ttl: int, redis_url: Optional[str] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize, ttl)
+        self._redis_url = redis_url
+        self._redis: Optional[redis.Redis] = None
+
+    def _get_redis(self) -> Optional[redis.Redis]:
+        """Lazily create the Redis client on first use"""
+        if self._redis is None and self._redis_url:
+            self._redis = redis.from_url(self._redis_url, decode_responses=True)
+        return self._redis
+
+    async def get(self, key: str) -> Optional[str]:
+        """Look up a cached response text"""
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+
+        client = self._get_redis()
+        if client is None:
+            return None
+
+        try:
+            value = await client.get(f"{self.namespace}:{key}")
+        except Exception as e:
+            logger.warning("Redis cache read failed: %s", e)
+            return None
+
+        if value is not None:
+            self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        """Store a response text in both tiers"""
+        self.memory.set(key, value)
+
+        client = self._get_redis()
+        if client is None:
+            return
+
+        try:
+            await client.setex(f"{self.namespace}:{key}", self.ttl, value)
+        except Exception as e:
+            logger.warning("Redis cache write failed: %s", e)
+
+
+class SemanticCache:
+    """
+    Bounded cache mapping embeddings to values by cosine similarity. Keys are lists of chunk
+    embeddings; an entry matches only with the same chunk count and every aligned chunk similar.
+    """
+
+    def __init__(self, threshold: float, maxsize: int = 256):
+        self.threshold = threshold
+        self._entries: deque = deque(maxlen=maxsize)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> List[float]:
+        """L2-normalize a vector so dot products equal cosine similarity"""
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else list(vector)
+
+    def lookup(self, embeddings: List[List[float]]) -> Optional[Any]:
+        """Return a copy of the most similar cached value above the threshold"""
+        query = [self._normalize(embedding) for embedding in embeddings]
+        best_score, best_value = 0.0, None
+
+        with self._lock:
+            for vectors, value in self._entries:
+                if len(vectors) != len(query):
+                    continue
+                # The least similar chunk decides, so one differing section rules an entry out
+                score = min(
+                    sum(a * b for a, b in zip(query_vector, vector))
+                    for query_vector, vector in zip(query, vectors)
+                )
+                if score > best_score:
+                    best_score, best_value = score, value
+
+        if best_value is None or best_score < self.threshold:
+            return None
+        return copy.deepcopy(best_value)
+
+    def add(self, embeddings: List[List[float]], value: Any) -> None:
+        """Insert a value, evicting the oldest entry when full"""
+        vectors = [self._normalize(embedding) for embedding in embeddings]
+        with self._lock:
+            self._entries.append((vectors, copy.deepcopy(value)))
+
+    def clear(self) -> None:
+        """Drop all cached entries"""
+        with self._lock:
+            self._entries.clear()
+
+
+class InflightRequests:
+    """Coalesce concurrent identical calls onto a single in-flight task"""
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Await the in-flight task for `key`, starting `call()` if there is none"""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # Shield so one caller's cancellation does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        """Drop a finished task, retrieving its exception so it is never reported as unhandled"""
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()
+
+
+# Shared cache for raw Gemini response texts
+gemini_response_cache = ResponseCache(
+    namespace="gemini",
+    maxsize=config.RESPONSE_CACHE_SIZE,
+    ttl=config.RESPONSE_CACHE_TTL_SECONDS,
+    redis_url=config.REDIS_URL
+)
+
+# Shared cache for analyses of near-identical documents
+semantic_analysis_cache = SemanticCache(
+    threshold=config.SEMANTIC_CACHE_THRESHOLD,
+    maxsize=config.SEMANTIC_CACHE_SIZE
+)
+
+# Shared cache for complete analysis results, serialized as JSON
+analysis_result_cache = ResponseCache(
+    namespace="analysis",
+    maxsize=config.RESPONSE_CACHE_SIZE,
+    ttl=config.RESPONSE_CACHE_TTL_SECONDS,
+    redis_url=config.REDIS_URL
+)
+
+# Shared cache for Vision OCR results, keyed by image content hash
+ocr_result_cache = ResponseCache(
+    namespace="ocr",
+    maxsize=config.OCR_CACHE_SIZE,
+    ttl=config.RESPONSE_CACHE_TTL_SECONDS,
+    redis_url=config.REDIS_URL
+)
+
+# Shared across clients so identical concurrent Gemini calls are sent once
+gemini_inflight = InflightRequests()
@@ -6,7 +6,102 @@ import re
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 
-@dataclass
+import orjson
+
+from ai.response_cache import LRUCache
+
+# Single-pass matcher for well-formed LABEL / INTENSITY / RECOMMENDATION triples
+_INSIGHT_RE = re.compile(r"""
+    ^[ \t]*[-•*]?[ \t]*(?P<label>RISK|COMPLIANCE|SUGGESTION|ANALYSIS):[ \t]*(?P<description>[^\n]+?)[ \t]*\n\s*
+    ^[ \t]*[-•*]?[ \t]*INTENSITY:[ \t]*(?P<intensity>High|Medium|Low)\b[^\n]*\n\s*
+    ^[ \t]*[-•*]?[ \t]*RECOMMENDATION:[ \t]*(?P<recommendation>.+?)
+    (?=\n[ \t]*\n|\s*^[ \t]*[-•*]?[ \t]*(?:RISK|COMPLIANCE|SUGGESTION|ANALYSIS):|\s*\Z)
+""", re.MULTILINE | re.DOTALL | re.IGNORECASE | re.VERBOSE)
+# Every insight label, to check that the fast path matched all of a response's blocks
+_LABEL_RE = re.compile(r'(?:RISK|COMPLIANCE|SUGGESTION|ANALYSIS):', re.IGNORECASE)
+
+# Parsed insights by (response text, default type), shared by all parser instances
+_parse_cache = LRUCache(maxsize=256)
+
+# Regex patterns for different insight components
+_PATTERNS = {
+    'risk': re.compile(r'(?:RISK|Risk):\s*(.+?)(?=\n|INTENSITY|RECOMMENDATION|$)', re.IGNORECASE | re.DOTALL),
+    'compliance': re.compile(r'(?:COMPLIANCE|Compliance):\s*(.+?)(?=\n|INTENSITY|RECOMMENDATION|$)', re.IGNORECASE | re.DOTALL),
+    'suggestion': re.compile(r'(?:SUGGESTION|Suggestion):\s*(.+?)(?=\n|INTENSITY|RECOMMENDATION|$)', re.IGNORECASE | re.DOTALL),
+    'analysis': re.compile(r'(?:ANALYSIS|Analysis):\s*(.+?)(?=\n|INTENSITY|RECOMMENDATION|$)', re.IGNORECASE | re.DOTALL),
+    'intensity': re.compile(r'(?:INTENSITY|Intensity):\s*(High|Medium|Low)', re.IGNORECASE),
+    'recommendation': re.compile(r'(?:RECOMMENDATION|Recommendation):\s*(.+?)(?=\n(?:RISK|COMPLIANCE|SUGGESTION|ANALYSIS)|$)', re.IGNORECASE | re.DOTALL)
+}
+
+# Any insight label with its description, so a block needs only one search
+_TYPE_RE = re.compile(r'(?P<kind>RISK|COMPLIANCE|SUGGESTION|ANALYSIS):\s*(?P<body>.+?)(?=\n|INTENSITY|RECOMMENDATION|$)', re.IGNORECASE | re.DOTALL)
+
+# Fallback patterns for less structured responses
+_FALLBACK_PATTERNS = {
+    'bullet_points': re.compile(r'^\s*[-•*]\s*(.+)', re.MULTILINE),
+    'numbered_points': re.compile(r'^\s*\d+\.\s*(.+)', re.MULTILINE),
+    'intensity_keywords': re.compile(r'\b(critical|high|significant|major|serious|important|medium|moderate|low|minor|minimal)\b', re.IGNORECASE)
+}
+
+# Document type detection response fields
+_DOC_TYPE_RE = re.compile(r'Document Type:\s*(.+)', re.IGNORECASE)
+_CATEGORY_RE = re.compile(r'Category:\s*(.+)', re.IGNORECASE)
+_CONFIDENCE_RE = re.compile(r'Confidence:\s*(High|Medium|Low)', re.IGNORECASE)
+# Common document type words, for responses without a "Document Type:" line
+_DOC_TYPE_WORD_RE = re.compile('agreement|contract|policy|terms|conditions|lease|nda|employment', re.IGNORECASE)
+
+# Markdown emphasis, stripped in this order (bold before italic) so nested emphasis unwraps fully
+_MD_BOLD = re.compile(r'\*\*([^*]+)\*\*')
+_MD_ITAL = re.compile(r'\*([^*]+)\*')
+_MD_BOLD_U = re.compile(r'__([^_]+)__')
+_MD_ITAL_U = re.compile(r'_([^_]+)_')
+
+# Block and sentence splitting
+_BLOCK_SPLIT_RE = re.compile(r'\n\s*\n|(?=(?:RISK|COMPLIANCE|SUGGESTION|ANALYSIS):|^\s*[-•*]|\d+\.)')
+_SENTENCE_SPLIT_RE = re.compile(r'[.!?]+')
+
+# Keywords for determining insight type (earlier types take priority)
+_TYPE_KEYWORDS = {
+    'risk': ['risk', 'danger', 'threat', 'liability', 'exposure', 'vulnerability', 'concern', 'problem', 'issue'],
+    'compliance': ['compliance', 'regulatory', 'legal', 'requirement', 'mandate', 'obligation', 'violation', 'breach'],
+    'suggestion': ['suggest', 'recommend', 'improve', 'enhance', 'optimize', 'consider', 'should', 'could', 'might']
+}
+_KEYWORD_TYPE = {keyword: insight_type for insight_type, keywords in _TYPE_KEYWORDS.items() for keyword in keywords}
+_TYPE_KEYWORD_RE = re.compile('|'.join(sorted(map(re.escape, _KEYWORD_TYPE), key=len, reverse=True)), re.IGNORECASE)
+
+# Intensity mapping
+_INTENSITY_MAPPING = {
+    'critical': 'High',
+    'high': 'High',
+    'significant': 'High',
+    'major': 'High',
+    'serious': 'High',
+    'important': 'Medium',
+    'medium': 'Medium',
+    'moderate': 'Medium',
+    'low': 'Low',
+    'minor': 'Low',
+    'minimal': 'Low'
+}
+
+# Intensity keywords ranked so the highest one found wins
+_LEVEL_RANK = {'Low': 1, 'Medium': 2, 'High': 3}
+_RANK_LEVEL = {rank: level for level, rank in _LEVEL_RANK.items()}
+_INTENSITY_RANK = {keyword: _LEVEL_RANK[level] for keyword, level in _INTENSITY_MAPPING.items()}
+
+# Content indicators used when no intensity keyword is present
+_HIGH_INDICATOR_RE = re.compile('must|required|critical|essential|urgent', re.IGNORECASE)
+_MEDIUM_INDICATOR_RE = re.compile('should|recommended|important|consider', re.IGNORECASE)
+
+# Fallback recommendation per insight type (any other type gets the suggestion text)
+_SUGGESTION_RECOMMENDATION = "Review this recommendation and consider implementing the suggested improvements."
+_DEFAULT_RECOMMENDATIONS = {
+    'risk': "Consider mitigating this risk through contract amendments or additional safeguards.",
+    'compliance': "Ensure compliance by consulting legal counsel and updating relevant clauses.",
+    'suggestion': _SUGGESTION_RECOMMENDATION
+}
+
+@dataclass(frozen=True, slots=True)
 class ParsedInsight:
     type: str  # risk, compliance, suggestion, analysis
     intensity: str  # high, medium, low
@@ -18,44 +113,13 @@ class InsightTextParser:
     """Robust parser for extracting insights from free-text LLM responses"""
     
     def __init__(self):
-        # Regex patterns for different insight components
-        self.patterns = {
-            'risk': re.compile(r'(?:RISK|Risk):\s*(.+?)(?=\n|INTENSITY|RECOMMENDATION|$)', re.IGNORECASE | re.DOTALL),
-            'compliance': re.compile(r'(?:COMPLIANCE|Compliance):\s*(.+?)(?=\n|INTENSITY|RECOMMENDATION|$)', re.IGNORECASE | re.DOTALL),
-            'suggestion': re.compile(r'(?:SUGGESTION|Suggestion):\s*(.+?)(?=\n|INTENSITY|RECOMMENDATION|$)', re.IGNORECASE | re.DOTALL),
-            'analysis': re.compile(r'(?:ANALYSIS|Analysis):\s*(.+?)(?=\n|INTENSITY|RECOMMENDATION|$)', re.IGNORECASE | re.DOTALL),
-            'intensity': re.compile(r'(?:INTENSITY|Intensity):\s*(High|Medium|Low)', re.IGNORECASE),
-            'recommendation': re.compile(r'(?:RECOMMENDATION|Recommendation):\s*(.+?)(?=\n(?:RISK|COMPLIANCE|SUGGESTION|ANALYSIS)|$)', re.IGNORECASE | re.DOTALL)
-        }
-        
-        # Fallback patterns for less structured responses
-        self.fallback_patterns = {
-            'bullet_points': re.compile(r'^\s*[-•*]\s*(.+)', re.MULTILINE),
-            'numbered_points': re.compile(r'^\s*\d+\.\s*(.+)', re.MULTILINE),
-            'intensity_keywords': re.compile(r'\b(critical|high|significant|major|serious|important|medium|moderate|low|minor|minimal)\b', re.IGNORECASE)
-        }
+        # Regex patterns are compiled once at module level and shared by all instances
+        self.patterns = _PATTERNS
+        self.fallback_patterns = _FALLBACK_PATTERNS
         
-        # Keywords for determining insight type
-        self.type_keywords = {
-            'risk': ['risk', 'danger', 'threat', 'liability', 'exposure', 'vulnerability', 'concern', 'problem', 'issue'],
-            'compliance': ['compliance', 'regulatory', 'legal', 'requirement', 'mandate', 'obligation', 'violation', 'breach'],
-            'suggestion': ['suggest', 'recommend', 'improve', 'enhance', 'optimize', 'consider', 'should', 'could', 'might']
-        }
-        
-        # Intensity mapping
-        self.intensity_mapping = {
-            'critical': 'High',
-            'high': 'High',
-            'significant': 'High',
-            'major': 'High',
-            'serious': 'High',
-            'important': 'Medium',
-            'medium': 'Medium',
-            'moderate': 'Medium',
-            'low': 'Low',
-            'minor': 'Low',
-            'minimal': 'Low'
-        }
+        # Keywords for determining insight type and intensity
+        self.type_keywords = _TYPE_KEYWORDS
+        self.intensity_mapping = _INTENSITY_MAPPING
 
     def parse_document_type(self, response_text: str) -> Dict[str, str]:
         """Parse document type detection response"""
@@ -66,41 +130,43 @@ class InsightTextParser:
         }
         
         # Look for structured format first
-        type_match = re.search(r'Document Type:\s*(.+)', response_text, re.IGNORECASE)
+        type_match = _DOC_TYPE_RE.search(response_text)
         if type_match:
             result['document_type'] = type_match.group(1).strip()
         
-        category_match = re.search(r'Category:\s*(.+)', response_text, re.IGNORECASE)
+        category_match = _CATEGORY_RE.search(response_text)
         if category_match:
             result['category'] = category_match.group(1).strip()
             
-        confidence_match = re.search(r'Confidence:\s*(High|Medium|Low)', response_text, re.IGNORECASE)
+        confidence_match = _CONFIDENCE_RE.search(response_text)
         if confidence_match:
             result['confidence'] = confidence_match.group(1).title()
         
         # Fallback: try to extract document type from first few lines
         if result['document_type'] == 'Unknown Document':
-            lines = response_text.split('\n')[:3]
-            for line in lines:
+            for line in response_text.split('\n', 3)[:3]:
                 line = line.strip()
-                if line and not line.startswith('Based on') and not line.startswith('This document'):
+                if line and not line.startswith(('Based on', 'This document')):
                     # Look for common document types
-                    doc_types = ['agreement', 'contract', 'policy', 'terms', 'conditions', 'lease', 'nda', 'employment']
-                    for doc_type in doc_types:
-                        if doc_type.lower() in line.lower():
-                            result['document_type'] = line
-                            break
+                    if _DOC_TYPE_WORD_RE.search(line):
+                        result['document_type'] = line
                     break
         
         return result
 
     def parse_insights_from_text(self, response_text: str, default_type: str = 'suggestion') -> List[ParsedInsight]:
         """Parse insights from free-text response"""
-        insights = []
+        cache_key = (response_text, default_type)
+        cached_insights = _parse_cache.get(cache_key)
+        if cached_insights is not None:
+            return list(cached_insights)
+        
+        # JSON responses need no regex passes at all
+        insights = self._parse_json_format(response_text, default_type)
         
-        # Try structured parsing first
-        structured_insights = self._parse_structured_format(response_text, default_type)
-        if structured_insights:
+        # Try structured parsing next
+        if not insights:
+            structured_insights = self._parse_structured_format(response_text, default_type)
             insights.extend(structured_insights)
         
         # If no structured insights found, try fallback parsing
@@ -118,13 +184,82 @@ class InsightTextParser:
                 confidence=0.6
             ))
         
+        # ParsedInsight is frozen, so only the list needs copying
+        _parse_cache.set(cache_key, tuple(insights))
         return insights
 
+    def parse_structured_insights(self, items: List[Dict[str, Any]], insight_type: str) -> List[ParsedInsight]:
+        """
+        Convert JSON-mode insight objects into ParsedInsight instances.
+        Items may carry their own `type_of_insight`; otherwise `insight_type` is used.
+        """
+        insights = []
+        
+        for item in items or []:
+            if not isinstance(item, dict):
+                continue
+            
+            item_type = str(item.get('type_of_insight') or insight_type)
+            
+            description = str(item.get('description') or '').strip()
+            if not description:
+                continue
+            
+            intensity = str(item.get('intensity') or '').title()
+            if intensity not in ('High', 'Medium', 'Low'):
+                intensity = self._infer_intensity(description)
+            
+            recommendation = str(item.get('recommendation') or '').strip()
+            if not recommendation:
+                recommendation = self._generate_recommendation(item_type, description)
+            
+            insights.append(ParsedInsight(
+                type=item_type,
+                intensity=intensity,
+                description=description,
+                recommendation=recommendation,
+                confidence=0.9
+            ))
+        
+        return insights
+
+    def _parse_json_format(self, text: str, default_type: str) -> List[ParsedInsight]:
+        """Parse a JSON insights payload (a list, or an object with an `insights` list)"""
+        stripped = text.strip()
+        if not stripped.startswith(('{', '[')):
+            return []
+        
+        try:
+            payload = orjson.loads(stripped)
+        except orjson.JSONDecodeError:
+            return []
+        
+        if isinstance(payload, dict):
+            payload = payload.get('insights')
+        if not isinstance(payload, list):
+            return []
+        
+        return self.parse_structured_insights(payload, default_type)
+
     def _parse_structured_format(self, text: str, default_type: str) -> List[ParsedInsight]:
         """Parse text with structured RISK/COMPLIANCE/SUGGESTION format"""
+        # Fast path: responses that follow the requested format exactly, for every block
+        matches = list(_INSIGHT_RE.finditer(text))
+        if matches and len(matches) == len(_LABEL_RE.findall(text)):
+            insights = []
+            for match in matches:
+                label = match.group('label').lower()
+                insights.append(ParsedInsight(
+                    type=label if label != 'analysis' else default_type,
+                    intensity=match.group('intensity').title(),
+                    description=self._clean_markdown(match.group('description')),
+                    recommendation=self._clean_markdown(match.group('recommendation')),
+                    confidence=0.8
+                ))
+            return insights
+        
+        # Otherwise (some block is malformed) split text into potential insight blocks
         insights = []
-        
-        # Split text into potential insight blocks
         blocks = self._split_into_blocks(text)
         
         for block in blocks:
@@ -137,26 +272,19 @@ class InsightTextParser:
     def _parse_single_block(self, block: str, default_type: str) -> Optional[ParsedInsight]:
         """Parse a single insight block"""
         # Extract type and description
-        description = None
-        insight_type = default_type
-        
-        for type_name, pattern in self.patterns.items():
-            if type_name in ['risk', 'compliance', 'suggestion', 'analysis']:
-                match = pattern.search(block)
-                if match:
-                    description = match.group(1).strip()
-                    insight_type = type_name if type_name != 'analysis' else default_type
-                    break
+        match = _TYPE_RE.search(block)
+        if not match:
+            return None
         
+        description = match.group('body').strip()
         if not description:
             return None
         
+        kind = match.group('kind').lower()
+        insight_type = kind if kind != 'analysis' else default_type
+        
         # Clean up description - remove markdown formatting
-        description = re.sub(r'\*\*([^*]+)\*\*', r'\1', description)
-        description = re.sub(r'\*([^*]+)\*', r'\1', description)
-        description = re.sub(r'__([^_]+)__', r'\1', description)
-        description = re.sub(r'_([^_]+)_', r'\1', description)
-        description = description.strip()
+        description = self._clean_markdown(description)
         
         # Extract intensity
         intensity_match = self.patterns['intensity'].search(block)
@@ -167,11 +295,7 @@ class InsightTextParser:
         recommendation = rec_match.group(1).strip() if rec_match else "Consider reviewing this item carefully."
         # Also clean markdown from recommendation
         if recommendation:
-            recommendation = re.sub(r'\*\*([^*]+)\*\*', r'\1', recommendation)
-            recommendation = re.sub(r'\*([^*]+)\*', r'\1', recommendation)
-            recommendation = re.sub(r'__([^_]+)__', r'\1', recommendation)
-            recommendation = re.sub(r'_([^_]+)_', r'\1', recommendation)
-            recommendation = recommendation.strip()
+            recommendation = self._clean_markdown(recommendation)
         
         return ParsedInsight(
             type=insight_type,
@@ -181,6 +305,17 @@ class InsightTextParser:
             confidence=0.8
         )
 
+    def _clean_markdown(self, text: str) -> str:
+        """Remove bold/italic markdown formatting"""
+        # Passes for a marker the text doesn't contain can't change it, so skip them
+        if '*' in text:
+            text = _MD_BOLD.sub(r'\1', text)
+            text = _MD_ITAL.sub(r'\1', text)
+        if '_' in text:
+            text = _MD_BOLD_U.sub(r'\1', text)
+            text = _MD_ITAL_U.sub(r'\1', text)
+        return text.strip()
+
     def _parse_unstructured_format(self, text: str, default_type: str) -> List[ParsedInsight]:
         """Parse unstructured text using fallback methods"""
         insights = []
@@ -214,13 +349,7 @@ class InsightTextParser:
         intensity = self._infer_intensity(text)
         
         # Clean up description - remove markdown formatting
-        description = text.strip()
-        # Remove markdown bold formatting
-        description = re.sub(r'\*\*([^*]+)\*\*', r'\1', description)
-        # Remove other markdown formatting
-        description = re.sub(r'\*([^*]+)\*', r'\1', description)
-        description = re.sub(r'__([^_]+)__', r'\1', description)
-        description = re.sub(r'_([^_]+)_', r'\1', description)
+        description = self._clean_markdown(text)
         
         if description.endswith('.'):
             description = description[:-1]
@@ -238,10 +367,10 @@ class InsightTextParser:
 
     def _infer_type(self, text: str, default_type: str) -> str:
         """Infer insight type from text content"""
-        text_lower = text.lower()
+        found_types = {_KEYWORD_TYPE[keyword.lower()] for keyword in _TYPE_KEYWORD_RE.findall(text)}
         
-        for insight_type, keywords in self.type_keywords.items():
-            if any(keyword in text_lower for keyword in keywords):
+        for insight_type in _TYPE_KEYWORDS:
+            if insight_type in found_types:
                 return insight_type
         
         return default_type
@@ -252,60 +381,39 @@ class InsightTextParser:
         
         if intensity_matches:
             # Take the highest intensity found
-            for intensity in ['critical', 'high', 'significant', 'major', 'serious']:
-                if any(match.lower() == intensity for match in intensity_matches):
-                    return 'High'
-            
-            for intensity in ['important', 'medium', 'moderate']:
-                if any(match.lower() == intensity for match in intensity_matches):
-                    return 'Medium'
-            
-            return 'Low'
+            return _RANK_LEVEL[max(_INTENSITY_RANK[match.lower()] for match in intensity_matches)]
         
         # Default based on content indicators
-        text_lower = text.lower()
-        if any(word in text_lower for word in ['must', 'required', 'critical', 'essential', 'urgent']):
+        if _HIGH_INDICATOR_RE.search(text):
             return 'High'
-        elif any(word in text_lower for word in ['should', 'recommended', 'important', 'consider']):
+        elif _MEDIUM_INDICATOR_RE.search(text):
             return 'Medium'
         else:
             return 'Low'
 
     def _generate_recommendation(self, insight_type: str, description: str) -> str:
         """Generate a basic recommendation based on insight type"""
-        if insight_type == 'risk':
-            return "Consider mitigating this risk through contract amendments or additional safeguards."
-        elif insight_type == 'compliance':
-            return "Ensure compliance by consulting legal counsel and updating relevant clauses."
-        else:  # suggestion
-            return "Review this recommendation and consider implementing the suggested improvements."
+        return _DEFAULT_RECOMMENDATIONS.get(insight_type, _SUGGESTION_RECOMMENDATION)
 
     def _split_into_blocks(self, text: str) -> List[str]:
         """Split text into logical blocks for parsing"""
         # Split by double newlines or by structured markers
-        blocks = re.split(r'\n\s*\n|(?=(?:RISK|COMPLIANCE|SUGGESTION|ANALYSIS):|^\s*[-•*]|\d+\.)', text)
-        return [block.strip() for block in blocks if block.strip()]
+        stripped_blocks = (block.strip() for block in _BLOCK_SPLIT_RE.split(text))
+        return [block for block in stripped_blocks if block]
 
     def _split_into_sentences(self, text: str) -> List[str]:
         """Split text into sentences"""
-        sentences = re.split(r'[.!?]+', text)
-        return [sentence.strip() for sentence in sentences if len(sentence.strip()) > 10]
+        stripped_sentences = (sentence.strip() for sentence in _SENTENCE_SPLIT_RE.split(text))
+        return [sentence for sentence in stripped_sentences if len(sentence) > 10]
 
     def _extract_main_content(self, text: str) -> str:
         """Extract the main content from a response for fallback"""
-        lines = text.split('\n')
-        content_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith('Based on') and not line.startswith('Document'):
-                content_lines.append(line)
-        
-        main_content = ' '.join(content_lines)
+        stripped_lines = (line.strip() for line in text.splitlines())
+        main_content = ' '.join(
+            line for line in stripped_lines
+            if line and not line.startswith(('Based on', 'Document'))
+        )
         # Remove markdown formatting
-        main_content = re.sub(r'\*\*([^*]+)\*\*', r'\1', main_content)
-        main_content = re.sub(r'\*([^*]+)\*', r'\1', main_content)
-        main_content = re.sub(r'__([^_]+)__', r'\1', main_content)
-        main_content = re.sub(r'_([^_]+)_', r'\1', main_content)
+        main_content = self._clean_markdown(main_content)
         
         return main_content[:200] + "..." if len(main_content) > 200 else main_content
\ No newline at end of file
@@ -2,15 +2,76 @@
 Google Cloud Vision API integration for OCR processing
 """
 
+import asyncio
+import hashlib
 import os
-from typing import Tuple, Dict, Any, Optional
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from google.api_core import exceptions as google_exceptions
+from google.api_core import retry as google_retry
 from google.cloud import vision
 import fitz  # PyMuPDF for PDF page extraction
 from PIL import Image
 import io
+import orjson
 
 from utils.errors import AIServiceError
 from config import config
+from ai.executors import ocr_executor, cpu_executor, vision_rate_limiter
+from ai.pdf_render import load_pdf_page, render_page
+from ai.response_cache import ocr_result_cache
+
+# Vision accepts at most 16 images per batch_annotate_images request
+VISION_BATCH_SIZE = 16
+
+_TEXT_DETECTION = vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)
+
+
+def _is_rate_limit(exc: Exception) -> bool:
+    """Whether a Vision error is throttling that is worth retrying"""
+    if isinstance(exc, google_exceptions.ResourceExhausted):
+        return True
+    message = str(exc).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """Transient transport failures and throttling are retried; everything else fails fast"""
+    return google_retry.if_transient_error(exc) or _is_rate_limit(exc)
+
+
+# Failures reported as AIServiceError; anything else is a bug and propagates unchanged
+_OCR_ERRORS = (
+    AIServiceError,
+    google_exceptions.GoogleAPICallError,
+    google_exceptions.RetryError,
+    OSError,
+    fitz.FileDataError
+)
+
+
+def _image_key(kind: str, img_data: bytes) -> str:
+    """Key OCR results by the exact image bytes sent to Vision"""
+    return f"{kind}:{hashlib.blake2b(img_data, digest_size=16).hexdigest()}"
+
+
+def file_digest(file_path: str) -> str:
+    """Content hash of a whole file, as used in its OCR result cache key"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Back off 1s, 2s, 4s ... (capped at 16s) on transient errors, giving up after 60s in total
+_VISION_RETRY = google_retry.Retry(
+    predicate=_is_retryable,
+    initial=1.0,
+    maximum=16.0,
+    multiplier=2.0,
+    timeout=60.0
+)
 
 
 class VisionOCR:
@@ -30,7 +91,7 @@ class VisionOCR:
                 content = image_file.read()
             
             image = vision.Image(content=content)
-            response = self.client.text_detection(image=image)
+            response = self.client.text_detection(image=image, retry=_VISION_RETRY)
             
             if response.error.message:
                 raise AIServiceError(f"Vision API error: {response.error.message}")
@@ -61,94 +122,279 @@ class VisionOCR:
             
             return full_text, ocr_data
             
-        except Exception as e:
+        except _OCR_ERRORS as e:
             raise AIServiceError(f"Error processing image with Vision API: {str(e)}")
     
+    def _page_result(self, response, page_num: int) -> Tuple[str, Dict[str, Any]]:
+        """Convert a Vision text detection response into page text and OCR data"""
+        if response.error.message:
+            raise AIServiceError(f"Vision API error: {response.error.message}")
+        
+        texts = response.text_annotations
+        
+        if not texts:
+            return "", {"page": page_num, "confidence": 0}
+        
+        full_text = texts[0].description
+        
+        ocr_data = {
+            "page": page_num,
+            "confidence": getattr(texts[0], 'confidence', 0),
+            "text_blocks": len(texts) - 1
+        }
+        
+        return full_text, ocr_data
+    
+    def _annotate_pages(self, page_images: List[Tuple[int, bytes]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Run text detection for up to VISION_BATCH_SIZE rendered pages in one Vision RPC"""
+        requests = [
+            vision.AnnotateImageRequest(image=vision.Image(content=img_data), features=[_TEXT_DETECTION])
+            for _, img_data in page_images
+        ]
+        response = self.client.batch_annotate_images(requests=requests, retry=_VISION_RETRY)
+        
+        return [
+            self._page_result(page_response, page_num)
+            for (page_num, _), page_response in zip(page_images, response.responses)
+        ]
+    
+    def _ocr_pixmap(self, img_data: bytes, page_num: int) -> Tuple[str, Dict[str, Any]]:
+        """Run text detection on one rendered page image"""
+        image = vision.Image(content=img_data)
+        response = self.client.text_detection(image=image, retry=_VISION_RETRY)
+        
+        return self._page_result(response, page_num)
+    
     def extract_text_from_pdf_page(self, pdf_path: str, page_num: int) -> Tuple[str, Dict[str, Any]]:
         """Extract text from a specific PDF page using OCR"""
         try:
-            # Open PDF and get the page as an image
-            doc = fitz.open(pdf_path)
-            page = doc.load_page(page_num)
-            
-            # Convert page to image
-            mat = fitz.Matrix(2.0, 2.0)  # Zoom factor for better OCR
-            pix = page.get_pixmap(matrix=mat)
-            img_data = pix.tobytes("png")
-            
-            doc.close()
-            
-            # Process with Vision API
-            image = vision.Image(content=img_data)
-            response = self.client.text_detection(image=image)
-            
-            if response.error.message:
-                raise AIServiceError(f"Vision API error: {response.error.message}")
-            
-            texts = response.text_annotations
+            with fitz.open(pdf_path) as doc:
+                img_data = render_page(doc.load_page(page_num))
             
-            if not texts:
-                return "", {"page": page_num, "confidence": 0}
+            return self._ocr_pixmap(img_data, page_num)
             
-            full_text = texts[0].description
+        except _OCR_ERRORS as e:
+            raise AIServiceError(f"Error processing PDF page {page_num}: {str(e)}")
+    
+    async def _run_pdf_pipeline(
+        self,
+        pdf_path: str,
+        page_count: int,
+        emit: Callable[[int, Tuple[str, Dict[str, Any]]], None]
+    ) -> None:
+        """
+        OCR PDF pages as a pipeline: worker processes render pages into a bounded queue
+        while earlier pages are already being annotated in batched Vision RPCs. Pages
+        that carry an embedded text layer use it directly and never reach Vision.
+        Each finished page is passed to emit(page_num, (page_text, page_data))
+        """
+        loop = asyncio.get_running_loop()
+        render_queue: asyncio.Queue = asyncio.Queue(maxsize=config.OCR_RENDER_QUEUE_SIZE)
+        in_flight = asyncio.Semaphore(config.OCR_CONCURRENCY)
+        render_slots = asyncio.Semaphore(config.CPU_WORKER_PROCESSES)
+        page_keys: Dict[int, str] = {}
+        
+        async def render_one(page_num: int) -> None:
+            async with render_slots:
+                embedded_text, img_data = await loop.run_in_executor(
+                    cpu_executor, load_pdf_page, pdf_path, page_num
+                )
+            if img_data is None:
+                # Born-digital page: its text layer is exact, so skip Vision
+                emit(page_num, (embedded_text, {
+                    "page": page_num,
+                    "confidence": 1.0,
+                    "text_blocks": len(embedded_text.split()),
+                    "source": "embedded"
+                }))
+                return
             
-            ocr_data = {
-                "page": page_num,
-                "confidence": getattr(texts[0], 'confidence', 0),
-                "text_blocks": len(texts) - 1
-            }
+            key = _image_key("page", img_data)
+            cached = await ocr_result_cache.get(key)
+            if cached is not None:
+                # Identical page image seen before (e.g. a re-upload)
+                page_text, page_data = orjson.loads(cached)
+                emit(page_num, (page_text, {**page_data, "page": page_num}))
+                return
             
-            return full_text, ocr_data
+            page_keys[page_num] = key
+            await render_queue.put((page_num, img_data))
+        
+        async def render() -> None:
+            # Rasterization is CPU-bound, so pages render in parallel across worker processes
+            await asyncio.gather(*(render_one(page_num) for page_num in range(page_count)))
+            await render_queue.put(None)
+        
+        async def annotate(batch: List[Tuple[int, bytes]]) -> None:
+            try:
+                # Vision quota is counted per image, not per batch request
+                await vision_rate_limiter.acquire(len(batch))
+                batch_results = await loop.run_in_executor(ocr_executor, self._annotate_pages, batch)
+            finally:
+                in_flight.release()
+            for (page_num, _), page_result in zip(batch, batch_results):
+                emit(page_num, page_result)
+                await ocr_result_cache.set(page_keys[page_num], orjson.dumps(page_result).decode())
+        
+        async def dispatch(tasks: asyncio.TaskGroup) -> None:
+            batch: List[Tuple[int, bytes]] = []
+            while True:
+                item = await render_queue.get()
+                if item is not None:
+                    batch.append(item)
+                if batch and (item is None or len(batch) == VISION_BATCH_SIZE):
+                    # Waiting for a free slot backpressures the renderer through the queue
+                    await in_flight.acquire()
+                    tasks.create_task(annotate(batch))
+                    batch = []
+                if item is None:
+                    return
+        
+        try:
+            async with asyncio.TaskGroup() as tasks:
+                tasks.create_task(render())
+                tasks.create_task(dispatch(tasks))
+        except ExceptionGroup as eg:
+            raise eg.exceptions[0]
+    
+    async def _iter_pdf_pages(
+        self, pdf_path: str, page_count: int
+    ) -> AsyncIterator[Tuple[int, Tuple[str, Dict[str, Any]]]]:
+        """Yield (page_num, (page_text, page_data)) as each page finishes, in completion order"""
+        finished: asyncio.Queue = asyncio.Queue()
+        
+        async def run() -> None:
+            try:
+                await self._run_pdf_pipeline(pdf_path, page_count, lambda *page: finished.put_nowait(page))
+            except Exception as e:
+                finished.put_nowait(e)
+        
+        pipeline = asyncio.ensure_future(run())
+        try:
+            for _ in range(page_count):
+                item = await finished.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stop rendering and OCR if the consumer goes away early
+            pipeline.cancel()
+    
+    async def _ocr_pdf_pages(self, pdf_path: str, page_count: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """OCR all pages of a PDF, returning results in page order"""
+        page_results: List[Optional[Tuple[str, Dict[str, Any]]]] = [None] * page_count
+        async for page_num, page_result in self._iter_pdf_pages(pdf_path, page_count):
+            page_results[page_num] = page_result
+        return page_results
+    
+    @staticmethod
+    def assemble_pdf_results(page_results: List[Tuple[str, Dict[str, Any]]]) -> Tuple[str, Dict[str, Any]]:
+        """Combine per-page OCR results (in page order) into document text and OCR data"""
+        text_parts = []
+        all_ocr_data = {
+            "pages": [],
+            "total_pages": len(page_results),
+            "avg_confidence": 0
+        }
+        
+        total_confidence = 0
+        pages_processed = 0
+        
+        for page_num, (page_text, page_data) in enumerate(page_results):
+            if page_text.strip():
+                text_parts.append(f"\n--- Page {page_num + 1} ---\n")
+                text_parts.append(page_text)
+                all_ocr_data["pages"].append(page_data)
+                total_confidence += page_data.get("confidence", 0)
+                pages_processed += 1
+        
+        if pages_processed > 0:
+            all_ocr_data["avg_confidence"] = total_confidence / pages_processed
+        
+        return "".join(text_parts).strip(), all_ocr_data
+    
+    async def iter_extract_text(self, file_path: str) -> AsyncIterator[Tuple[int, str, Dict[str, Any]]]:
+        """
+        OCR a PDF, yielding (page_num, page_text, page_data) as soon as each page is done
+        Pages arrive in completion order, not page order
+        """
+        if not os.path.exists(file_path):
+            raise AIServiceError(f"File not found: {file_path}")
+        
+        if file_path.lower().split('.')[-1] != 'pdf':
+            raise AIServiceError("Streaming OCR is only supported for PDF files")
+        
+        try:
+            with fitz.open(file_path) as doc:
+                page_count = doc.page_count
             
-        except Exception as e:
-            raise AIServiceError(f"Error processing PDF page {page_num}: {str(e)}")
+            async for page_num, (page_text, page_data) in self._iter_pdf_pages(file_path, page_count):
+                yield page_num, page_text, page_data
+                
+        except _OCR_ERRORS as e:
+            raise AIServiceError(f"Error processing PDF with OCR: {str(e)}")
     
-    def extract_text(self, file_path: str) -> Tuple[str, Dict[str, Any]]:
+    async def extract_text_async(
+        self, file_path: str, content_digest: Optional[str] = None
+    ) -> Tuple[str, Dict[str, Any]]:
         """
-        Extract text from file (image or PDF) using OCR
+        Extract text from file (image or PDF) using OCR, processing PDF pages concurrently.
+        Whole-file results are cached by content; pass `content_digest` (file_digest of the
+        file, e.g. computed while it was written) to skip re-reading the file to hash it.
         Returns: (extracted_text, ocr_data)
         """
         if not os.path.exists(file_path):
             raise AIServiceError(f"File not found: {file_path}")
         
         file_extension = file_path.lower().split('.')[-1]
+        if file_extension not in ['jpg', 'jpeg', 'png', 'pdf']:
+            raise AIServiceError(f"Unsupported file type for OCR: {file_extension}")
+        
+        loop = asyncio.get_running_loop()
+        if content_digest is None:
+            content_digest = await loop.run_in_executor(ocr_executor, file_digest, file_path)
         
-        if file_extension in ['jpg', 'jpeg', 'png']:
-            return self.extract_text_from_image(file_path)
+        key = f"{'pdf' if file_extension == 'pdf' else 'image'}:{content_digest}"
+        cached = await ocr_result_cache.get(key)
+        if cached is not None:
+            return tuple(orjson.loads(cached))
         
-        elif file_extension == 'pdf':
+        if file_extension == 'pdf':
             # Process all pages of the PDF
             try:
-                doc = fitz.open(file_path)
-                all_text = ""
-                all_ocr_data = {
-                    "pages": [],
-                    "total_pages": doc.page_count,
-                    "avg_confidence": 0
-                }
+                with fitz.open(file_path) as doc:
+                    page_count = doc.page_count
                 
-                total_confidence = 0
-                pages_processed = 0
+                page_results = await self._ocr_pdf_pages(file_path, page_count)
+                result = self.assemble_pdf_results(page_results)
                 
-                for page_num in range(doc.page_count):
-                    page_text, page_data = self.extract_text_from_pdf_page(file_path, page_num)
-                    
-                    if page_text.strip():
-                        all_text += f"\n--- Page {page_num + 1} ---\n"
-                        all_text += page_text
-                        all_ocr_data["pages"].append(page_data)
-                        total_confidence += page_data.get("confidence", 0)
-                        pages_processed += 1
-                
-                doc.close()
-                
-                if pages_processed > 0:
-                    all_ocr_data["avg_confidence"] = total_confidence / pages_processed
-                
-                return all_text.strip(), all_ocr_data
-                
-            except Exception as e:
+            except _OCR_ERRORS as e:
                 raise AIServiceError(f"Error processing PDF with OCR: {str(e)}")
-        
         else:
-            raise AIServiceError(f"Unsupported file type for OCR: {file_extension}")
\ No newline at end of file
+            async with vision_rate_limiter:
+                result = await loop.run_in_executor(ocr_executor, self.extract_text_from_image, file_path)
+        
+        await ocr_result_cache.set(key, orjson.dumps(result).decode())
+        return result
+    
+    def extract_text(self, file_path: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Extract text from file (image or PDF) using OCR
+        Synchronous wrapper around extract_text_async; not for use inside a running event loop
+        Returns: (extracted_text, ocr_data)
+        """
+        return asyncio.run(self.extract_text_async(file_path))
+
+
+_vision_ocr: Optional[VisionOCR] = None
+_vision_ocr_lock = threading.Lock()
+
+
+def get_vision_ocr() -> VisionOCR:
+    """Return the shared VisionOCR; its gRPC channel multiplexes concurrent requests"""
+    global _vision_ocr
+    if _vision_ocr is None:
+        with _vision_ocr_lock:
+            if _vision_ocr is None:
+                _vision_ocr = VisionOCR()
+    return _vision_ocr
\ No newline at end of file
@@ -7,21 +7,17 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import Optional
 from datetime import timedelta
-
-# Rate limiting
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+import asyncio
+import time
 
 from auth.utils import (
-    create_user, authenticate_user, create_session, 
+    create_user, create_session, authenticate_and_create_session,
     create_access_token, verify_token, get_user,
-    update_user_password
+    update_user_password, token_user_cache, user_cache_generation
 )
+from utils.rate_limit import limiter
 from config import config
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
-
 
 class UserCreate(BaseModel):
     username: str
@@ -58,6 +54,13 @@ security = HTTPBearer()
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current authenticated user from JWT token"""
     token = credentials.credentials
+    
+    cached = token_user_cache.get(token)
+    if cached is not None:
+        expires_at, generation, user = cached
+        if expires_at > time.time() and generation == user_cache_generation(user["username"]):
+            return user
+    
     payload = verify_token(token)
     
     if payload is None:
@@ -75,7 +78,9 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = get_user(username)
+    # Taken before the lookup so a change made meanwhile leaves this entry stale, not current
+    generation = user_cache_generation(username)
+    user = await asyncio.to_thread(get_user, username)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -83,6 +88,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    token_user_cache.set(token, (payload.get("exp", 0), generation, user))
     return user
 
 
@@ -91,8 +97,9 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 async def register(request: Request, user_data: UserCreate):
     """Register a new user"""
     try:
-        user = create_user(user_data.username, user_data.password)
-        session_uid = create_session(user_data.username)
+        # bcrypt hashing and database writes run off the event loop
+        user = await asyncio.to_thread(create_user, user_data.username, user_data.password)
+        session_uid = await asyncio.to_thread(create_session, user_data.username)
         
         return UserResponse(
             user_id=user["user_id"],
@@ -115,29 +122,27 @@ async def register(request: Request, user_data: UserCreate):
 @limiter.limit("10/minute")  # Limit login attempts to prevent brute force
 async def login(request: Request, user_data: UserLogin):
     """Login user and return access token"""
-    # First check if user exists
-    from .utils import get_user
-    user = get_user(user_data.username)
-    
-    if not user:
+    # Check the account, verify the password and open a session in one lookup
+    # (bcrypt is CPU-bound, keep it off the event loop)
+    try:
+        result = await asyncio.to_thread(
+            authenticate_and_create_session, user_data.username, user_data.password
+        )
+    except ValueError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Account does not exist, please register.",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Now authenticate with password
-    authenticated_user = authenticate_user(user_data.username, user_data.password)
-    
-    if not authenticated_user:
+    if result is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Create new session
-    session_uid = create_session(user_data.username)
+    authenticated_user, session_uid = result
     
     # Create access token
     access_token_expires = timedelta(minutes=config.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -168,7 +173,7 @@ async def logout(request: Request, current_user: dict = Depends(get_current_user
 async def get_current_user_info(request: Request, current_user: dict = Depends(get_current_user)):
     """Get current user information"""
     # Extract session_uid from the latest session (could be improved)
-    latest_session = max(current_user["sessions"].keys()) if current_user["sessions"] else None
+    latest_session = current_user.get("latest_session")
     
     return UserResponse(
         user_id=current_user["user_id"],
@@ -201,7 +206,8 @@ async def update_password(
             )
         
         # Update the password
-        success = update_user_password(
+        success = await asyncio.to_thread(
+            update_user_password,
             current_user["username"],
             password_data.current_password,
             password_data.new_password
@@ -2,19 +2,62 @@
 Authentication utilities for password hashing and session management
 """
 
-import json
 import os
+import sqlite3
+import threading
 import uuid
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import bcrypt
+import orjson
 from jose import JWTError, jwt
 from config import config
+from ai.response_cache import LRUCache
+
+# Authenticated users by bearer token, so hot tokens skip the database entirely
+token_user_cache = LRUCache(maxsize=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL_SECONDS)
+
+# Per-username generation stored with each cached user; bumping it invalidates only that user's tokens
+_user_generations: Dict[str, int] = {}
+_user_generations_lock = threading.Lock()
+
+
+def user_cache_generation(username: str) -> int:
+    """Current cache generation for a user (read before loading the user to cache it)"""
+    return _user_generations.get(username, 0)
+
+
+def invalidate_cached_user(username: str) -> None:
+    """Make cached token lookups for this user stale without touching other users' entries"""
+    with _user_generations_lock:
+        _user_generations[username] = _user_generations.get(username, 0) + 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_uid TEXT PRIMARY KEY,
+    username TEXT NOT NULL REFERENCES users(username),
+    created_at TEXT NOT NULL,
+    last_activity TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_username ON sessions(username);
+"""
+
+# One SQLite connection per thread; the schema is created once per process
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
 
 
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt"""
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=config.BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
@@ -46,35 +89,80 @@ def verify_token(token: str) -> Optional[Dict[str, Any]]:
         return None
 
 
-def load_users() -> Dict[str, Any]:
-    """Load users from JSON file"""
+def _migrate_users_file(conn: sqlite3.Connection) -> None:
+    """Import users and sessions from the legacy users.json into an empty database"""
+    if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None:
+        return
     try:
-        with open(config.USERS_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+        with open(config.USERS_FILE, 'rb') as f:
+            users = orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return
+    
+    with conn:
+        for user in users.values():
+            conn.execute(
+                "INSERT OR IGNORE INTO users (username, user_id, password_hash, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user["username"], user["user_id"], user["password_hash"],
+                 user["created_at"], user.get("updated_at"))
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO sessions (session_uid, username, created_at, last_activity) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (session["session_uid"], user["username"], session["created_at"], session["last_activity"])
+                    for session in user.get("sessions", {}).values()
+                ]
+            )
 
 
-def save_users(users: Dict[str, Any]) -> None:
-    """Save users to JSON file"""
+def _get_connection() -> sqlite3.Connection:
+    """Return this thread's connection to the users database"""
+    global _schema_ready
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+    
     os.makedirs(config.SYSTEM_DIR, exist_ok=True)
-    with open(config.USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+    conn = sqlite3.connect(config.USERS_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.executescript(_SCHEMA)
+                _migrate_users_file(conn)
+                _schema_ready = True
+    
+    _local.conn = conn
+    return conn
 
 
 def get_user(username: str) -> Optional[Dict[str, Any]]:
     """Get user by username"""
-    users = load_users()
-    return users.get(username)
+    conn = _get_connection()
+    row = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+    if row is None:
+        return None
+    
+    user = {key: row[key] for key in row.keys() if row[key] is not None}
+    user["sessions"] = {
+        session["session_uid"]: dict(session)
+        for session in conn.execute(
+            "SELECT session_uid, created_at, last_activity FROM sessions WHERE username = ?",
+            (username,)
+        )
+    }
+    # Resolved once here so routes don't rescan the sessions on every request
+    user["latest_session"] = max(user["sessions"], default=None)
+    return user
 
 
 def create_user(username: str, password: str) -> Dict[str, Any]:
     """Create a new user"""
-    users = load_users()
-    
-    if username in users:
-        raise ValueError("User already exists")
-    
     user_id = str(uuid.uuid4())
     hashed_password = hash_password(password)
     
@@ -86,35 +174,68 @@ def create_user(username: str, password: str) -> Dict[str, Any]:
         "sessions": {}
     }
     
-    users[username] = user_data
-    save_users(users)
+    try:
+        with _get_connection() as conn:
+            conn.execute(
+                "INSERT INTO users (username, user_id, password_hash, created_at) VALUES (?, ?, ?, ?)",
+                (username, user_id, hashed_password, user_data["created_at"])
+            )
+    except sqlite3.IntegrityError:
+        raise ValueError("User already exists")
     
     return user_data
 
 
+def _insert_session(conn: sqlite3.Connection, username: str, user_id: str) -> str:
+    """Record a new session for a known user and create its directory"""
+    session_uid = str(uuid.uuid4())
+    now = datetime.utcnow().isoformat()
+    
+    with conn:
+        conn.execute(
+            "INSERT INTO sessions (session_uid, username, created_at, last_activity) VALUES (?, ?, ?, ?)",
+            (session_uid, username, now, now)
+        )
+    # Cached users carry their latest session, so only this user's entries go stale
+    invalidate_cached_user(username)
+    
+    # Create session directory
+    session_dir = os.path.join(config.DATA_DIR, user_id, session_uid)
+    os.makedirs(session_dir, exist_ok=True)
+    
+    return session_uid
+
+
 def create_session(username: str) -> str:
     """Create a new session for a user"""
-    users = load_users()
-    user = users.get(username)
+    conn = _get_connection()
+    row = conn.execute("SELECT user_id FROM users WHERE username = ?", (username,)).fetchone()
     
-    if not user:
+    if not row:
         raise ValueError("User not found")
     
-    session_uid = str(uuid.uuid4())
-    session_data = {
-        "session_uid": session_uid,
-        "created_at": datetime.utcnow().isoformat(),
-        "last_activity": datetime.utcnow().isoformat()
-    }
+    return _insert_session(conn, username, row["user_id"])
+
+
+def authenticate_and_create_session(username: str, password: str) -> Optional[Tuple[Dict[str, Any], str]]:
+    """
+    Verify credentials and open a session with a single user lookup
+    Returns ({"user_id", "username"}, session_uid), or None for a wrong password;
+    raises ValueError if the user does not exist
+    """
+    conn = _get_connection()
+    row = conn.execute(
+        "SELECT user_id, username, password_hash FROM users WHERE username = ?", (username,)
+    ).fetchone()
     
-    user["sessions"][session_uid] = session_data
-    save_users(users)
+    if not row:
+        raise ValueError("User not found")
     
-    # Create session directory
-    session_dir = os.path.join(config.DATA_DIR, user["user_id"], session_uid)
-    os.makedirs(session_dir, exist_ok=True)
+    if not verify_password(password, row["password_hash"]):
+        return None
     
-    return session_uid
+    user = {"user_id": row["user_id"], "username": row["username"]}
+    return user, _insert_session(conn, username, row["user_id"])
 
 
 def authenticate_user(username: str, password: str) -> Optional[Dict[str, Any]]:
@@ -136,15 +257,13 @@ def update_user_password(username: str, current_password: str, new_password: str
     if not user:
         return False
     
-    # Load all users
-    users = load_users()
-    
     # Update the password hash
-    users[username]["password_hash"] = hash_password(new_password)
-    users[username]["updated_at"] = datetime.utcnow().isoformat()
-    
-    # Save users back to file
-    save_users(users)
+    with _get_connection() as conn:
+        conn.execute(
+            "UPDATE users SET password_hash = ?, updated_at = ? WHERE username = ?",
+            (hash_password(new_password), datetime.utcnow().isoformat(), username)
+        )
+    invalidate_cached_user(username)
     
     return True
 
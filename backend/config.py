@@ -3,21 +3,25 @@ Configuration settings for DocuMint Backend
 """
 
 import os
+from functools import cached_property
 from typing import Optional
 from pathlib import Path
 
 class Config:
     # File upload settings
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB in bytes
-    ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png'}
+    MAX_REQUEST_SIZE = MAX_FILE_SIZE + 64 * 1024  # room for multipart framing around the file
+    ALLOWED_EXTENSIONS = frozenset({'pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png'})
     
     # Data storage paths
     DATA_DIR = "data"
     SYSTEM_DIR = os.path.join(DATA_DIR, "system")
-    USERS_FILE = os.path.join(SYSTEM_DIR, "users.json")
+    USERS_DB = os.path.join(SYSTEM_DIR, "users.db")
+    USERS_FILE = os.path.join(SYSTEM_DIR, "users.json")  # legacy store, imported into USERS_DB
     
     # Google API keys (can be set via environment variables or files)
-    @property
+    # Secrets are resolved on first access and memoized; see invalidate_secret_cache()
+    @cached_property
     def GEMINI_API_KEY(self) -> Optional[str]:
         # First try direct environment variable (preferred for Cloud Run)
         api_key = os.getenv("GEMINI_API_KEY")
@@ -37,8 +41,63 @@ class Config:
     
     GOOGLE_CLOUD_VISION_CREDENTIALS: Optional[str] = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     
+    # Worker processes for CPU-bound document parsing and PDF page rendering
+    CPU_WORKER_PROCESSES: int = int(os.getenv("CPU_WORKER_PROCESSES", str(os.cpu_count() or 1)))
+    
+    # Vision OCR concurrency and rendered pages buffered ahead of Vision
+    OCR_CONCURRENCY: int = int(os.getenv("OCR_CONCURRENCY", "8"))
+    OCR_RENDER_QUEUE_SIZE: int = int(os.getenv("OCR_RENDER_QUEUE_SIZE", "4"))
+    # PDF page render resolution (raise for dense small print at the cost of larger uploads),
+    # with the longest rendered edge capped so oversized pages are scaled down
+    OCR_RENDER_DPI: int = int(os.getenv("OCR_RENDER_DPI", "144"))
+    OCR_MAX_EDGE_PX: int = int(os.getenv("OCR_MAX_EDGE_PX", "2048"))
+    VISION_RPM: int = int(os.getenv("VISION_RPM", "1800"))
+    # PDF pages with more embedded text than this many characters skip OCR
+    OCR_SKIP_NATIVE_THRESHOLD: int = int(os.getenv("OCR_SKIP_NATIVE_THRESHOLD", "50"))
+    # Upload-time OCR runs in the background; stop reporting it as in progress after this long
+    OCR_BACKGROUND_TIMEOUT_SECONDS: int = int(os.getenv("OCR_BACKGROUND_TIMEOUT_SECONDS", "900"))
+    
+    # Gemini request concurrency
+    GEMINI_MAX_CONCURRENCY: int = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+    GEMINI_POOL_SIZE: int = int(os.getenv("GEMINI_POOL_SIZE", "16"))
+    GEMINI_RPM: int = int(os.getenv("GEMINI_RPM", "60"))
+    # Analyze documents in the background once their text is ready (spends quota on every upload)
+    ANALYSIS_PREWARM_ENABLED: bool = os.getenv("ANALYSIS_PREWARM_ENABLED", "false").lower() == "true"
+    
+    # Documents are whitespace-normalized and capped at this length before prompting
+    MAX_DOC_CHARS: int = int(os.getenv("MAX_DOC_CHARS", "400000"))
+    
+    # Gemini explicit context caching (only worthwhile above the API's minimum token count)
+    GEMINI_CONTEXT_CACHE_ENABLED: bool = os.getenv("GEMINI_CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+    GEMINI_CONTEXT_CACHE_MODEL: str = os.getenv("GEMINI_CONTEXT_CACHE_MODEL", "models/gemini-1.5-flash-002")
+    GEMINI_CONTEXT_CACHE_MIN_CHARS: int = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_CHARS", str(32768 * 4)))
+    GEMINI_CONTEXT_CACHE_TTL_MIN: int = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_MIN", "5"))
+    GEMINI_CONTEXT_CACHE_SIZE: int = int(os.getenv("GEMINI_CONTEXT_CACHE_SIZE", "64"))
+    
+    # Gemini response cache settings
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+    RESPONSE_CACHE_TTL_SECONDS: int = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+    REDIS_URL: Optional[str] = os.getenv("REDIS_URL")
+    ANALYZE_CACHE_SIZE: int = int(os.getenv("ANALYZE_CACHE_SIZE", "256"))
+    QA_CACHE_SIZE: int = int(os.getenv("QA_CACHE_SIZE", "1024"))
+    QA_CACHE_TTL_SECONDS: int = int(os.getenv("QA_CACHE_TTL_SECONDS", "600"))
+    OCR_CACHE_SIZE: int = int(os.getenv("OCR_CACHE_SIZE", "512"))
+    DOCUMENT_TEXT_CACHE_SIZE: int = int(os.getenv("DOCUMENT_TEXT_CACHE_SIZE", "256"))
+    DOCUMENT_TEXT_CACHE_TTL_SECONDS: int = int(os.getenv("DOCUMENT_TEXT_CACHE_TTL_SECONDS", "300"))
+    METADATA_CACHE_SIZE: int = int(os.getenv("METADATA_CACHE_SIZE", "1024"))
+    
+    # Semantic (embedding similarity) caches for whole-document analyses and rephrased questions
+    SEMANTIC_CACHE_ENABLED: bool = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+    SEMANTIC_CACHE_SIZE: int = int(os.getenv("SEMANTIC_CACHE_SIZE", "256"))
+    EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
+    EMBEDDING_MAX_CHARS: int = int(os.getenv("EMBEDDING_MAX_CHARS", "8000"))
+    # Documents are embedded in EMBEDDING_MAX_CHARS chunks, at most this many (one batch request);
+    # the default covers a whole MAX_DOC_CHARS document
+    EMBEDDING_MAX_CHUNKS: int = int(os.getenv("EMBEDDING_MAX_CHUNKS", "64"))
+    
     # Security settings
-    @property
+    @cached_property
     def SECRET_KEY(self) -> str:
         # First try direct environment variable (preferred for Cloud Run)
         secret_key = os.getenv("SECRET_KEY")
@@ -57,14 +116,28 @@ class Config:
         # Fallback to default (not recommended for production)
         return "your-secret-key-change-in-production"
     
+    def invalidate_secret_cache(self) -> None:
+        """Forget memoized secrets so the next access re-reads env vars/files (e.g. after rotation)"""
+        for name in ("GEMINI_API_KEY", "SECRET_KEY"):
+            self.__dict__.pop(name, None)
+    
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # bcrypt cost factor for new hashes (existing hashes keep the cost they were made with)
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    
+    # Authenticated user cache (per bearer token)
+    USER_CACHE_SIZE: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    USER_CACHE_TTL_SECONDS: int = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
     
     # CORS settings
     @property
     def ALLOWED_ORIGINS(self):
         origins_env = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000")
-        return [origin.strip() for origin in origins_env.split(",")]
+        return [origin.strip() for origin in origins_env.split(",") if origin.strip()]
+    
+    # Seconds browsers may reuse a preflight response (browsers cap this, e.g. Chromium at 2h)
+    CORS_MAX_AGE: int = int(os.getenv("CORS_MAX_AGE", "86400"))
 
 # Global config instance
 config = Config()
\ No newline at end of file
@@ -3,97 +3,223 @@ Document parsing utilities for PDF, DOC, DOCX files and metadata extraction
 """
 
 import os
+import re
+import zipfile
 import fitz  # PyMuPDF
-import docx2txt
-from docx import Document
-from datetime import datetime
-from typing import Dict, Any, Optional, Tuple
-import json
+from lxml import etree
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
 from PIL import Image
 
 from utils.errors import DocumentError
 
 
+# Leading bytes of each supported format; the file content decides which parser runs
+_MAGIC_NUMBERS = (
+    (b"%PDF-", "pdf"),
+    (b"PK\x03\x04", "docx"),  # ZIP container
+    (b"\xD0\xCF\x11\xE0", "doc"),  # OLE2 compound file
+    (b"\xFF\xD8\xFF", "jpg"),
+    (b"\x89PNG", "png"),
+)
+
+# Plain-text extraction: join words hyphenated across line breaks and expand ligatures
+# (no TEXT_PRESERVE_LIGATURES), clipped to the page like PyMuPDF's default "text" mode
+_TEXT_FLAGS = fitz.TEXT_DEHYPHENATE | fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+
+_WORD_RE = re.compile(r"\S+")
+
+# WordprocessingML tags read straight from the .docx package
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_BODY = f"{_W}body"
+_W_P = f"{_W}p"
+_W_T = f"{_W}t"
+_W_BR = f"{_W}br"
+_W_TYPE = f"{_W}type"
+# Run content and its plain-text rendering (matching python-docx's Paragraph.text)
+_W_RUN_TEXT = {
+    _W_T: None,
+    f"{_W}tab": "\t",
+    _W_BR: "\n",
+    f"{_W}cr": "\n",
+    f"{_W}noBreakHyphen": "-",
+}
+_CORE_PROPERTIES = {
+    "creation_date": "{http://purl.org/dc/terms/}created",
+    "title": "{http://purl.org/dc/elements/1.1/}title",
+    "author": "{http://purl.org/dc/elements/1.1/}creator",
+    "last_modified": "{http://purl.org/dc/terms/}modified",
+}
+
+_ALLOWED_EXT = frozenset({'pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png'})
+
+
 class DocumentParser:
     """Document parser for various file formats"""
     
+    @staticmethod
+    def _sniff(file_path: str) -> Optional[str]:
+        """Detect the file type from its header bytes (None if unrecognized)"""
+        with open(file_path, 'rb') as f:
+            header = f.read(16)
+        for magic, file_type in _MAGIC_NUMBERS:
+            if header.startswith(magic):
+                return file_type
+        return None
+    
     @staticmethod
     def get_file_extension(filename: str) -> str:
         """Get file extension in lowercase"""
-        return filename.lower().split('.')[-1] if '.' in filename else ''
+        i = filename.rfind('.')
+        return filename[i + 1:].lower() if i >= 0 else ''
+    
+    @staticmethod
+    def count_words(text: str) -> int:
+        """Count whitespace-separated words without materializing them as a list"""
+        return sum(1 for _ in _WORD_RE.finditer(text))
     
     @staticmethod
-    def validate_file(file_path: str, max_size: int = 10 * 1024 * 1024) -> Tuple[bool, str]:
-        """Validate file type and size"""
-        if not os.path.exists(file_path):
-            return False, "File does not exist"
+    def validate_file(
+        file_path: str, max_size: int = 10 * 1024 * 1024, file_size: Optional[int] = None
+    ) -> Tuple[bool, str]:
+        """Validate file type and size (pass file_size when the file was already stat'ed)"""
+        error_msg, _ = DocumentParser._check_file(file_path, max_size, file_size)
+        return error_msg is None, error_msg or "Valid file"
+    
+    @staticmethod
+    def _check_file(
+        file_path: str, max_size: int = 10 * 1024 * 1024, file_size: Optional[int] = None
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Validate a file and detect its type from its content
+        Returns: (error_msg, file_type) with error_msg None for a valid file
+        """
+        if file_size is None:
+            try:
+                file_size = os.stat(file_path).st_size
+            except FileNotFoundError:
+                return "File does not exist", None
         
         # Check file size
-        file_size = os.path.getsize(file_path)
         if file_size > max_size:
-            return False, f"File size ({file_size} bytes) exceeds maximum allowed size ({max_size} bytes)"
+            return f"File size ({file_size} bytes) exceeds maximum allowed size ({max_size} bytes)", None
         
         # Check file extension
-        allowed_extensions = {'pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png'}
         extension = DocumentParser.get_file_extension(file_path)
-        if extension not in allowed_extensions:
-            return False, f"File type '{extension}' not supported. Allowed types: {allowed_extensions}"
+        if extension not in _ALLOWED_EXT:
+            return f"File type '{extension}' not supported. Allowed types: {', '.join(sorted(_ALLOWED_EXT))}", None
         
-        return True, "Valid file"
+        # Check file content; every supported format has a fixed header, and a recognized one
+        # decides the type even when it contradicts the name
+        try:
+            file_type = DocumentParser._sniff(file_path)
+        except FileNotFoundError:
+            return "File does not exist", None
+        if file_type is None:
+            return f"File content is not a valid '{extension}' document", None
+        
+        return None, file_type
+    
+    @staticmethod
+    def _looks_image_based(page_texts) -> bool:
+        """A PDF whose first 3 pages have very little text is likely scanned"""
+        return sum(len(text.strip()) for text in page_texts[:3]) < 50
     
     @staticmethod
-    def extract_pdf_text(file_path: str) -> Tuple[str, Dict[str, Any]]:
+    def extract_pdf_text(file_path: str, file_size: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
         """Extract text from PDF file"""
+        text_content, metadata, _ = DocumentParser._extract_pdf(file_path, file_size)
+        return text_content, metadata
+    
+    @staticmethod
+    def _extract_pdf(file_path: str, file_size: Optional[int] = None) -> Tuple[str, Dict[str, Any], bool]:
+        """Extract text and metadata from a PDF and tell whether it is image-based, in one pass"""
         try:
-            doc = fitz.open(file_path)
-            text_content = ""
-            page_count = doc.page_count
-            has_text = False
-            
-            for page_num in range(page_count):
-                page = doc.load_page(page_num)
-                page_text = page.get_text()
-                text_content += page_text + "\n"
-                if page_text.strip():
-                    has_text = True
+            with fitz.open(file_path) as doc:
+                page_texts = []
+                has_text = False
+                
+                for page in doc:
+                    page_text = page.get_text("text", flags=_TEXT_FLAGS, sort=False)
+                    page_texts.append(page_text)
+                    if not has_text and page_text.strip():
+                        has_text = True
+                
+                metadata = {
+                    "page_count": doc.page_count,
+                    "has_extractable_text": has_text,
+                    "file_size": file_size if file_size is not None else os.path.getsize(file_path),
+                    "creation_date": doc.metadata.get("creationDate", ""),
+                    "title": doc.metadata.get("title", ""),
+                    "author": doc.metadata.get("author", "")
+                }
             
-            metadata = {
-                "page_count": page_count,
-                "has_extractable_text": has_text,
-                "file_size": os.path.getsize(file_path),
-                "creation_date": doc.metadata.get("creationDate", ""),
-                "title": doc.metadata.get("title", ""),
-                "author": doc.metadata.get("author", "")
-            }
-            
-            doc.close()
-            return text_content.strip(), metadata
+            image_based = DocumentParser._looks_image_based(page_texts)
+            return "\n".join(page_texts).strip(), metadata, image_based
             
         except Exception as e:
             raise DocumentError(f"Error parsing PDF: {str(e)}")
     
     @staticmethod
-    def extract_docx_text(file_path: str) -> Tuple[str, Dict[str, Any]]:
+    def _read_docx_paragraphs(archive: zipfile.ZipFile) -> Tuple[List[str], int]:
+        """Stream word/document.xml into paragraph texts, also counting top-level body paragraphs"""
+        paragraphs = []
+        body_paragraphs = 0
+        with archive.open("word/document.xml") as xml:
+            for _, element in etree.iterparse(xml, events=("end",), tag=_W_P):
+                parts = []
+                for node in element.iter(*_W_RUN_TEXT):
+                    if node.tag == _W_T:
+                        parts.append(node.text or "")
+                    elif node.tag != _W_BR or node.get(_W_TYPE, "textWrapping") == "textWrapping":
+                        parts.append(_W_RUN_TEXT[node.tag])
+                paragraphs.append("".join(parts))
+                
+                parent = element.getparent()
+                if parent.tag == _W_BODY:
+                    body_paragraphs += 1
+                # Discard parsed paragraphs so memory stays flat however long the document is
+                element.clear()
+                while element.getprevious() is not None:
+                    del parent[0]
+        return paragraphs, body_paragraphs
+    
+    @staticmethod
+    def _read_docx_core_properties(archive: zipfile.ZipFile) -> Dict[str, str]:
+        """Read title/author/dates from docProps/core.xml, dates as UTC ISO strings"""
+        try:
+            root = etree.fromstring(archive.read("docProps/core.xml"))
+        except KeyError:
+            return {name: "" for name in _CORE_PROPERTIES}
+        
+        properties = {}
+        for name, tag in _CORE_PROPERTIES.items():
+            value = (root.findtext(tag) or "").strip()
+            if value and name in ("creation_date", "last_modified"):
+                try:
+                    parsed = datetime.fromisoformat(value)
+                    value = parsed.astimezone(timezone.utc).isoformat() if parsed.tzinfo else parsed.isoformat()
+                except ValueError:
+                    value = ""
+            properties[name] = value
+        return properties
+    
+    @staticmethod
+    def extract_docx_text(file_path: str, file_size: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
         """Extract text from DOCX file"""
         try:
-            # Extract text using docx2txt (simpler)
-            text_content = docx2txt.process(file_path)
-            
-            # Get additional metadata using python-docx
-            doc = Document(file_path)
-            word_count = len(text_content.split()) if text_content else 0
-            paragraph_count = len(doc.paragraphs)
+            # Text comes from every paragraph in the body, including table cells
+            with zipfile.ZipFile(file_path) as archive:
+                paragraphs, paragraph_count = DocumentParser._read_docx_paragraphs(archive)
+                core_props = DocumentParser._read_docx_core_properties(archive)
+            text_content = "\n".join(paragraphs)
+            word_count = DocumentParser.count_words(text_content)
             
-            # Try to get document properties
-            core_props = doc.core_properties
             metadata = {
                 "word_count": word_count,
                 "paragraph_count": paragraph_count,
-                "file_size": os.path.getsize(file_path),
-                "creation_date": core_props.created.isoformat() if core_props.created else "",
-                "title": core_props.title or "",
-                "author": core_props.author or "",
-                "last_modified": core_props.modified.isoformat() if core_props.modified else ""
+                "file_size": file_size if file_size is not None else os.path.getsize(file_path),
+                **core_props
             }
             
             return text_content.strip(), metadata
@@ -102,7 +228,7 @@ class DocumentParser:
             raise DocumentError(f"Error parsing DOCX: {str(e)}")
     
     @staticmethod
-    def extract_doc_text(file_path: str) -> Tuple[str, Dict[str, Any]]:
+    def extract_doc_text(file_path: str, file_size: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
         """Extract text from DOC file (basic support)"""
         try:
             # For older DOC files, we'll provide basic metadata
@@ -110,7 +236,7 @@ class DocumentParser:
             text_content = ""  # DOC parsing would need additional libraries
             
             metadata = {
-                "file_size": os.path.getsize(file_path),
+                "file_size": file_size if file_size is not None else os.path.getsize(file_path),
                 "word_count": 0,
                 "format": "doc",
                 "note": "DOC format requires additional processing - consider converting to DOCX"
@@ -125,17 +251,15 @@ class DocumentParser:
     def is_image_based_pdf(file_path: str) -> bool:
         """Check if PDF is image-based (scanned) with no extractable text"""
         try:
-            doc = fitz.open(file_path)
-            total_text_length = 0
-            
-            for page_num in range(min(3, doc.page_count)):  # Check first 3 pages
-                page = doc.load_page(page_num)
-                text = page.get_text().strip()
-                total_text_length += len(text)
-            
-            doc.close()
+            with fitz.open(file_path) as doc:
+                total_text_length = 0
+                for page_num in range(min(3, doc.page_count)):  # Check first 3 pages
+                    total_text_length += len(doc.get_page_text(page_num, flags=_TEXT_FLAGS).strip())
+                    if total_text_length >= 50:
+                        # Enough text already; no need to parse the remaining pages
+                        return False
             # If very little text found, likely image-based
-            return total_text_length < 50
+            return True
             
         except Exception:
             return False
@@ -146,26 +270,34 @@ class DocumentParser:
         Parse document and return text, metadata, and whether OCR is needed
         Returns: (text_content, metadata, needs_ocr)
         """
-        # Validate file first
-        is_valid, error_msg = DocumentParser.validate_file(file_path)
-        if not is_valid:
+        # Stat once; the size is reused by validation and every parser's metadata
+        try:
+            file_size = os.stat(file_path).st_size
+        except FileNotFoundError:
+            raise DocumentError("File does not exist")
+        
+        # Validate file first; dispatch on its content when it contradicts the name,
+        # rather than failing in the wrong parser
+        error_msg, sniffed = DocumentParser._check_file(file_path, file_size=file_size)
+        if error_msg is not None:
             raise DocumentError(error_msg)
         
         extension = DocumentParser.get_file_extension(file_path)
+        if sniffed != ("jpg" if extension == "jpeg" else extension):
+            extension = sniffed
         needs_ocr = False
         
         if extension == 'pdf':
-            text_content, metadata = DocumentParser.extract_pdf_text(file_path)
-            needs_ocr = DocumentParser.is_image_based_pdf(file_path)
+            text_content, metadata, needs_ocr = DocumentParser._extract_pdf(file_path, file_size)
         elif extension == 'docx':
-            text_content, metadata = DocumentParser.extract_docx_text(file_path)
+            text_content, metadata = DocumentParser.extract_docx_text(file_path, file_size)
         elif extension == 'doc':
-            text_content, metadata = DocumentParser.extract_doc_text(file_path)
+            text_content, metadata = DocumentParser.extract_doc_text(file_path, file_size)
         elif extension in ['jpg', 'jpeg', 'png']:
             # Image files always need OCR
             text_content = ""
             metadata = {
-                "file_size": os.path.getsize(file_path),
+                "file_size": file_size,
                 "format": extension,
                 "is_image": True
             }
@@ -173,7 +305,8 @@ class DocumentParser:
         else:
             raise DocumentError(f"Unsupported file format: {extension}")
         
-        # Add common metadata
+        # Add common metadata (word counts are stored here so text requests never re-count)
+        metadata.setdefault("word_count", DocumentParser.count_words(text_content))
         metadata.update({
             "filename": os.path.basename(file_path),
             "extension": extension,
@@ -2,26 +2,35 @@
 Document handling routes for upload, processing, and AI analysis
 """
 
+import asyncio
+import hashlib
+import logging
 import os
 import tempfile
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, status, Request
+import orjson
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, status, Request, BackgroundTasks
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
-
-# Rate limiting
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+from typing import Optional, Dict, Any, Tuple
 
 from auth.routes import get_current_user
+from auth.utils import get_session_path
 from documents.parser import DocumentParser
 from documents.storage import DocumentStorage
-from ai.dynamic_gemini_client import DynamicGeminiClient
-from utils.response import success_response, error_response
-from utils.errors import DocumentError, AIServiceError
+from ai.dynamic_gemini_client import get_gemini_client
+from ai.executors import cpu_executor
+from utils.response import success_response, success_response_bytes, error_response
+from utils.errors import DocumentError, AIServiceError, FileValidationError
+from utils.rate_limit import limiter
 from config import config
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
+logger = logging.getLogger(__name__)
+
+# Uploads are copied to disk in pieces of this size instead of being read whole
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Questions shorter than this (after trimming) are rejected without a Gemini call
+MIN_QUERY_CHARS = 3
 
 
 class ProcessDocumentRequest(BaseModel):
@@ -40,17 +49,127 @@ class DocumentUploadResponse(BaseModel):
     metadata: Dict[str, Any]
 
 
-documents_router = APIRouter()
+documents_router = APIRouter(default_response_class=ORJSONResponse)
+
+
+def _raise_if_ocr_pending(user_id: str, session_uid: str, doc_id: str) -> None:
+    """Answer 202 while a document's background OCR is still running"""
+    entry = DocumentStorage.get_document_metadata(user_id, session_uid, doc_id)
+    if not entry or entry["metadata"].get("ocr_status") != "processing":
+        return
+    # Stop waiting on OCR a restart dropped
+    if not DocumentStorage.is_ocr_abandoned(entry):
+        raise HTTPException(
+            status_code=status.HTTP_202_ACCEPTED,
+            detail="OCR is still processing, try again shortly"
+        )
+
+
+def _raise_if_query_too_short(query: str) -> None:
+    """Answer 400 for empty or trivially short questions instead of spending a Gemini call on them"""
+    if len(query.strip()) < MIN_QUERY_CHARS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Please provide a more detailed question"
+        )
+
+
+def _ready_document_text(user_id: str, session_uid: str, doc_id: str) -> Optional[str]:
+    """A document's stored text, answering 202 while its background OCR is still running"""
+    _raise_if_ocr_pending(user_id, session_uid, doc_id)
+    return DocumentStorage.get_document_text(user_id, session_uid, doc_id)
+
+
+async def _prewarm_analysis(doc_id: str, document_text: str) -> None:
+    """Run a document's analysis ahead of /process-document so that request is served from cache"""
+    try:
+        await get_gemini_client().analyze_document_dynamic(doc_id, document_text)
+    except Exception as e:
+        logger.warning("Analysis pre-warm failed for document %s: %s", doc_id, e)
+
+
+async def _run_upload_ocr(
+    user_id: str, session_uid: str, doc_id: str, file_path: str, content_digest: str
+) -> None:
+    """OCR an uploaded document after its upload response is sent, recording the outcome in its metadata"""
+    try:
+        from ai.vision_ocr import get_vision_ocr
+        vision_client = get_vision_ocr()
+        # Re-uploads of the same file are served from the OCR result cache
+        ocr_text, ocr_data = await vision_client.extract_text_async(file_path, content_digest)
+        
+        # Save OCR results
+        await asyncio.to_thread(
+            DocumentStorage.save_ocr_results,
+            user_id, session_uid, doc_id, ocr_text, ocr_data
+        )
+        updates = {
+            "ocr_status": "completed",
+            "ocr_processed": True,
+            "ocr_text_length": len(ocr_text),
+            "ocr_word_count": DocumentParser.count_words(ocr_text)
+        }
+        
+    except Exception as e:
+        # OCR failed, but document upload succeeded
+        updates = {"ocr_status": "failed", "ocr_error": str(e)}
+    
+    await asyncio.to_thread(DocumentStorage.update_metadata, user_id, session_uid, doc_id, updates)
+    
+    if config.ANALYSIS_PREWARM_ENABLED and updates["ocr_status"] == "completed" and ocr_text:
+        await _prewarm_analysis(doc_id, ocr_text)
+
+
+def _record_stream_ocr_failure(user_id: str, session_uid: str, doc_id: str, error: str) -> None:
+    """Record a failed streaming OCR run, unless the document already has completed OCR to keep"""
+    entry = DocumentStorage.get_document_metadata(user_id, session_uid, doc_id)
+    if entry and entry["metadata"].get("ocr_status") != "completed":
+        DocumentStorage.update_metadata(
+            user_id, session_uid, doc_id, {"ocr_status": "failed", "ocr_error": error}
+        )
+
+
+def _spool_upload(source, suffix: str, directory: str) -> Tuple[str, str]:
+    """
+    Copy an upload's spooled body to a named temp file in `directory` (blocking), hashing
+    it on the way, then validates it (size, extension and header). Spooling into the session
+    directory lets the file be renamed into place later.
+    Returns: (temp_file_path, content_digest) with the digest matching vision_ocr.file_digest
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.blake2b(digest_size=16)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=directory) as temp_file:
+        try:
+            total = 0
+            while chunk := source.read(UPLOAD_CHUNK_SIZE):
+                total += len(chunk)
+                if total > config.MAX_FILE_SIZE:
+                    raise FileValidationError(
+                        f"File too large. Maximum size is {config.MAX_FILE_SIZE} bytes"
+                    )
+                temp_file.write(chunk)
+                digest.update(chunk)
+            
+            # Reject content that is not a supported document before it is deduplicated or parsed
+            temp_file.flush()
+            is_valid, error_msg = DocumentParser.validate_file(temp_file.name, config.MAX_FILE_SIZE, total)
+            if not is_valid:
+                raise DocumentError(error_msg)
+        except BaseException:
+            os.unlink(temp_file.name)
+            raise
+        return temp_file.name, digest.hexdigest()
 
 
 @documents_router.post("/upload", response_model=DocumentUploadResponse)
 @limiter.limit("20/minute")  # Limit document uploads
 async def upload_document(
     request: Request,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user: dict = Depends(get_current_user)
 ):
-    """Upload and parse a document"""
+    """Upload and parse a document; OCR, when needed, continues in the background"""
     try:
         # Validate file size
         if hasattr(file, 'size') and file.size and file.size > config.MAX_FILE_SIZE:
@@ -75,7 +194,7 @@ async def upload_document(
         
         # Get user session info (assume latest session for now)
         user_id = current_user["user_id"]
-        session_uid = max(current_user["sessions"].keys()) if current_user["sessions"] else None
+        session_uid = current_user.get("latest_session")
         
         if not session_uid:
             raise HTTPException(
@@ -83,59 +202,82 @@ async def upload_document(
                 detail="No active session found"
             )
         
-        # Save uploaded file to temporary location first
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_extension}") as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        # Save uploaded file to temporary location first, copying it in chunks off the event loop
+        await file.seek(0)
+        temp_file_path, content_digest = await asyncio.to_thread(
+            _spool_upload, file.file, f".{file_extension}", get_session_path(user_id, session_uid)
+        )
         
         try:
-            # Parse the document
-            text_content, metadata, needs_ocr = DocumentParser.parse_document(temp_file_path)
+            # The same file uploaded again into this session is already parsed (and OCRed, or
+            # OCR is running); one whose OCR failed or was abandoned is uploaded afresh to retry it
+            existing = await asyncio.to_thread(
+                DocumentStorage.find_document_by_digest, user_id, session_uid, content_digest
+            )
+            if existing:
+                return DocumentUploadResponse(
+                    doc_id=existing["doc_id"],
+                    filename=existing["original_filename"],
+                    needs_ocr=existing["metadata"].get("needs_ocr", False),
+                    metadata=existing["metadata"]
+                )
             
-            # Save file to user's session directory
-            doc_id, saved_file_path = DocumentStorage.save_uploaded_file(
-                temp_file_path, user_id, session_uid, file.filename
+            # Parsing is CPU-bound and runs in a worker process; storage writes are
+            # blocking I/O and run in threads, so neither stalls the event loop
+            text_content, metadata, needs_ocr = await asyncio.get_running_loop().run_in_executor(
+                cpu_executor, DocumentParser.parse_document, temp_file_path
             )
             
-            # Save metadata
-            DocumentStorage.save_metadata(
-                user_id, session_uid, doc_id, metadata, file.filename
+            # Move file into the user's session directory
+            doc_id, saved_file_path = await asyncio.to_thread(
+                DocumentStorage.save_uploaded_file,
+                temp_file_path, user_id, session_uid, file.filename, True
             )
             
-            # If OCR is needed and we have Vision API configured, process it
+            # Keep the parsed text so text/process/Q&A requests never re-parse the file
+            if text_content:
+                await asyncio.to_thread(
+                    DocumentStorage.save_document_text,
+                    user_id, session_uid, doc_id, text_content
+                )
+            
+            # If OCR is needed and we have Vision API configured, run it once the response
+            # is sent; clients poll /text/{doc_id}, which answers 202 until it completes
             if needs_ocr and config.GOOGLE_CLOUD_VISION_CREDENTIALS:
-                try:
-                    from ai.vision_ocr import VisionOCR
-                    vision_client = VisionOCR()
-                    ocr_text, ocr_data = vision_client.extract_text(saved_file_path)
-                    
-                    # Save OCR results
-                    DocumentStorage.save_ocr_results(
-                        user_id, session_uid, doc_id, ocr_text, ocr_data
-                    )
-                    
-                    # Update metadata to indicate OCR was processed
-                    metadata["ocr_processed"] = True
-                    metadata["ocr_text_length"] = len(ocr_text)
-                    
-                except Exception as e:
-                    # OCR failed, but document upload succeeded
-                    metadata["ocr_error"] = str(e)
-                    needs_ocr = True  # Still needs OCR
+                metadata["ocr_status"] = "processing"
+                background_tasks.add_task(
+                    _run_upload_ocr, user_id, session_uid, doc_id, saved_file_path, content_digest
+                )
+            elif config.ANALYSIS_PREWARM_ENABLED and text_content:
+                # Analyze while the client is still looking at the upload response
+                background_tasks.add_task(_prewarm_analysis, doc_id, text_content)
+            
+            # Save metadata (before the background OCR, which updates it with the outcome)
+            await asyncio.to_thread(
+                DocumentStorage.save_metadata,
+                user_id, session_uid, doc_id, metadata, file.filename,
+                os.path.basename(saved_file_path), content_digest
+            )
             
             return DocumentUploadResponse(
                 doc_id=doc_id,
                 filename=file.filename,
-                needs_ocr=needs_ocr and not metadata.get("ocr_processed", False),
+                needs_ocr=needs_ocr,
                 metadata=metadata
             )
             
         finally:
-            # Clean up temporary file
+            # Clean up temporary file (already gone once it was moved into place)
             if os.path.exists(temp_file_path):
                 os.unlink(temp_file_path)
     
+    except HTTPException:
+        raise
+    except FileValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
     except DocumentError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -148,6 +290,83 @@ async def upload_document(
         )
 
 
+@documents_router.get("/ocr/{doc_id}/stream")
+@limiter.limit("20/minute")  # Same budget as uploads: each call runs full OCR
+async def stream_document_ocr(
+    request: Request,
+    doc_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """OCR an uploaded PDF, streaming each page as NDJSON as soon as it is recognized"""
+    user_id = current_user["user_id"]
+    session_uid = current_user.get("latest_session")
+    
+    if not session_uid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No active session found"
+        )
+    
+    doc_path = await asyncio.to_thread(DocumentStorage.get_document_path, user_id, session_uid, doc_id)
+    if not doc_path or not doc_path.lower().endswith(".pdf"):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="PDF document not found"
+        )
+    
+    if not config.GOOGLE_CLOUD_VISION_CREDENTIALS:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Vision API not configured"
+        )
+    
+    from ai.vision_ocr import VisionOCR, get_vision_ocr
+    try:
+        vision_client = get_vision_ocr()
+    except AIServiceError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"AI service error: {str(e)}"
+        )
+    
+    async def page_lines():
+        page_results = {}
+        try:
+            async for page_num, page_text, page_data in vision_client.iter_extract_text(doc_path):
+                page_results[page_num] = (page_text, page_data)
+                yield orjson.dumps({**page_data, "page": page_num, "text": page_text}) + b"\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band; rendering and
+            # executor failures arrive here unwrapped, not only as AIServiceError
+            if isinstance(e, AIServiceError):
+                error = str(e)
+            else:
+                logger.exception("Streaming OCR failed for document %s", doc_id)
+                error = f"OCR failed: {str(e)}"
+            yield orjson.dumps({"error": error}) + b"\n"
+            await asyncio.to_thread(_record_stream_ocr_failure, user_id, session_uid, doc_id, error)
+            return
+        
+        # Persist the assembled result so the document is usable like an upload-time OCR
+        ocr_text, ocr_data = VisionOCR.assemble_pdf_results(
+            [page_results[page_num] for page_num in sorted(page_results)]
+        )
+        await asyncio.to_thread(
+            DocumentStorage.save_ocr_results, user_id, session_uid, doc_id, ocr_text, ocr_data
+        )
+        await asyncio.to_thread(
+            DocumentStorage.update_metadata, user_id, session_uid, doc_id,
+            {
+                "ocr_status": "completed",
+                "ocr_processed": True,
+                "ocr_text_length": len(ocr_text),
+                "ocr_word_count": DocumentParser.count_words(ocr_text)
+            }
+        )
+    
+    return StreamingResponse(page_lines(), media_type="application/x-ndjson")
+
+
 @documents_router.post("/process-document")
 @limiter.limit("35/minute")  # Limit intensive AI processing
 async def process_document(
@@ -158,7 +377,7 @@ async def process_document(
     """Process document with Gemini AI for insights and analysis"""
     try:
         user_id = current_user["user_id"]
-        session_uid = max(current_user["sessions"].keys()) if current_user["sessions"] else None
+        session_uid = current_user.get("latest_session")
         
         if not session_uid:
             raise HTTPException(
@@ -167,7 +386,9 @@ async def process_document(
             )
         
         # Get document text
-        document_text = DocumentStorage.get_document_text(user_id, session_uid, request_data.doc_id)
+        document_text = await asyncio.to_thread(
+            _ready_document_text, user_id, session_uid, request_data.doc_id
+        )
         if not document_text:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -182,14 +403,18 @@ async def process_document(
             )
         
         # Process with Dynamic Gemini Client
-        gemini_client = DynamicGeminiClient()
+        gemini_client = get_gemini_client()
         analysis_result = await gemini_client.analyze_document_dynamic(request_data.doc_id, document_text)
         
         # Save analysis results
-        DocumentStorage.save_analysis_results(user_id, session_uid, analysis_result)
+        await asyncio.to_thread(
+            DocumentStorage.save_analysis_results, user_id, session_uid, analysis_result
+        )
         
         return success_response(analysis_result, "Document analysis completed")
     
+    except HTTPException:
+        raise
     except AIServiceError as e:
         raise HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY,
@@ -212,7 +437,7 @@ async def document_qa(
     """Answer questions about a document using Gemini AI"""
     try:
         user_id = current_user["user_id"]
-        session_uid = max(current_user["sessions"].keys()) if current_user["sessions"] else None
+        session_uid = current_user.get("latest_session")
         
         if not session_uid:
             raise HTTPException(
@@ -220,8 +445,12 @@ async def document_qa(
                 detail="No active session found"
             )
         
+        _raise_if_query_too_short(request_data.query)
+        
         # Get document text
-        document_text = DocumentStorage.get_document_text(user_id, session_uid, request_data.doc_id)
+        document_text = await asyncio.to_thread(
+            _ready_document_text, user_id, session_uid, request_data.doc_id
+        )
         if not document_text:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -236,13 +465,15 @@ async def document_qa(
             )
         
         # Process Q&A with Dynamic Gemini Client
-        gemini_client = DynamicGeminiClient()
+        gemini_client = get_gemini_client()
         qa_result = await gemini_client.answer_question(
             request_data.doc_id, document_text, request_data.query
         )
         
         return success_response(qa_result, "Question answered successfully")
     
+    except HTTPException:
+        raise
     except AIServiceError as e:
         raise HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY,
@@ -255,31 +486,83 @@ async def document_qa(
         )
 
 
+@documents_router.post("/qa/stream")
+@limiter.limit("50/minute")  # Same budget as /qa
+async def stream_document_qa(
+    request: Request,
+    request_data: QARequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Answer a question about a document, streaming the answer as NDJSON chunks as Gemini writes it"""
+    user_id = current_user["user_id"]
+    session_uid = current_user.get("latest_session")
+    
+    if not session_uid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No active session found"
+        )
+    
+    _raise_if_query_too_short(request_data.query)
+    
+    document_text = await asyncio.to_thread(
+        _ready_document_text, user_id, session_uid, request_data.doc_id
+    )
+    if not document_text:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found or no text content available"
+        )
+    
+    if not config.GEMINI_API_KEY:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Gemini API not configured"
+        )
+    
+    try:
+        gemini_client = get_gemini_client()
+    except AIServiceError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"AI service error: {str(e)}"
+        )
+    
+    async def answer_lines():
+        try:
+            async for chunk in gemini_client.stream_answer(
+                request_data.doc_id, document_text, request_data.query
+            ):
+                yield orjson.dumps({"text": chunk}) + b"\n"
+        except AIServiceError as e:
+            # Headers are already sent, so report the failure in-band
+            yield orjson.dumps({"error": str(e)}) + b"\n"
+    
+    return StreamingResponse(answer_lines(), media_type="application/x-ndjson")
+
+
 @documents_router.get("/documents")
 @limiter.limit("30/minute")  # Allow frequent document listing
 async def list_documents(request: Request, current_user: dict = Depends(get_current_user)):
     """List all documents in current session"""
     try:
         user_id = current_user["user_id"]
-        session_uid = max(current_user["sessions"].keys()) if current_user["sessions"] else None
+        session_uid = current_user.get("latest_session")
         
         if not session_uid:
             return success_response([], "No active session")
         
-        # Get session directory
-        from auth.utils import get_session_path
-        session_dir = get_session_path(user_id, session_uid)
-        metadata_file = os.path.join(session_dir, "metadata.json")
-        
-        if not os.path.exists(metadata_file):
+        # Serialized once per metadata change, so it is sent without re-encoding
+        documents_json = await asyncio.to_thread(
+            DocumentStorage.list_documents_json, user_id, session_uid
+        )
+        if documents_json == b"[]":
             return success_response([], "No documents found")
         
-        # Load and return metadata
-        import json
-        with open(metadata_file, 'r') as f:
-            metadata = json.load(f)
-        
-        return success_response(list(metadata.values()), "Documents retrieved successfully")
+        return Response(
+            success_response_bytes(documents_json, "Documents retrieved successfully"),
+            media_type="application/json"
+        )
     
     except Exception as e:
         raise HTTPException(
@@ -298,7 +581,7 @@ async def get_document_text(
     """Get the extracted text content of a document"""
     try:
         user_id = current_user["user_id"]
-        session_uid = max(current_user["sessions"].keys()) if current_user["sessions"] else None
+        session_uid = current_user.get("latest_session")
         
         if not session_uid:
             raise HTTPException(
@@ -307,7 +590,7 @@ async def get_document_text(
             )
         
         # Get document text (OCR text if available, otherwise parsed text)
-        document_text = DocumentStorage.get_document_text(user_id, session_uid, doc_id)
+        document_text = await asyncio.to_thread(_ready_document_text, user_id, session_uid, doc_id)
         if not document_text:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -315,18 +598,25 @@ async def get_document_text(
             )
         
         # Get document metadata for additional info
-        metadata = DocumentStorage.get_document_metadata(user_id, session_uid, doc_id)
+        entry = await asyncio.to_thread(
+            DocumentStorage.get_document_metadata, user_id, session_uid, doc_id
+        )
+        metadata = entry["metadata"] if entry else {}
         
-        # Calculate basic stats
-        word_count = len(document_text.split())
-        page_count = metadata.get("page_count") if metadata else None
+        # Basic stats were counted at upload/OCR time; count only for documents saved before that
+        word_count = metadata.get("ocr_word_count" if metadata.get("ocr_processed") else "word_count")
+        if word_count is None:
+            word_count = await asyncio.to_thread(
+                DocumentStorage.get_word_count, user_id, session_uid, doc_id, document_text
+            )
+        page_count = metadata.get("page_count")
         
         response_data = {
             "doc_id": doc_id,
             "text": document_text,
             "word_count": word_count,
             "page_count": page_count,
-            "filename": metadata.get("filename") if metadata else None
+            "filename": entry.get("original_filename") if entry else None
         }
         
         return success_response(response_data, "Document text retrieved successfully")
@@ -2,15 +2,188 @@
 Document storage utilities for saving files and metadata
 """
 
+import gzip
 import os
-import json
+import orjson
 import uuid
 import shutil
-from typing import Dict, Any, Optional, Tuple
-from datetime import datetime
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timedelta
 
 from config import config
 from auth.utils import get_session_path
+from ai.response_cache import LRUCache
+
+# (OCR file stamp, text) by (user_id, session_uid, doc_id); entries are checked against the
+# OCR results file's mtime/size, and the TTL bounds how long a re-parsed text is kept
+_document_text_cache = LRUCache(
+    maxsize=config.DOCUMENT_TEXT_CACHE_SIZE,
+    ttl=config.DOCUMENT_TEXT_CACHE_TTL_SECONDS
+)
+
+# (OCR file stamp, word count) by (user_id, session_uid, doc_id), validated like the text cache
+_word_count_cache = LRUCache(
+    maxsize=config.DOCUMENT_TEXT_CACHE_SIZE,
+    ttl=config.DOCUMENT_TEXT_CACHE_TTL_SECONDS
+)
+
+# Parsed session metadata (with its serialized document list) per path,
+# reused until the file's mtime/size change
+_metadata_cache = LRUCache(maxsize=config.METADATA_CACHE_SIZE)
+
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _session_metadata_file(session_dir: str) -> str:
+    """Path of a session's metadata: metadata.jsonl, or metadata.json for sessions not yet migrated"""
+    metadata_file = os.path.join(session_dir, "metadata.jsonl")
+    legacy_file = os.path.join(session_dir, "metadata.json")
+    if not os.path.exists(metadata_file) and os.path.exists(legacy_file):
+        return legacy_file
+    return metadata_file
+
+
+def _load_metadata_file(metadata_file: str) -> Tuple[Dict[str, Any], bytes]:
+    """
+    Load a session's metadata keyed by doc_id plus the list_documents JSON,
+    skipping the parse when the file is unchanged (do not mutate)
+    """
+    stamp = _file_stamp(metadata_file)
+    if stamp is None:
+        return {}, b"[]"
+    
+    cached = _metadata_cache.get(metadata_file)
+    if cached is not None and cached[0] == stamp:
+        return cached[1], cached[2]
+    
+    with open(metadata_file, 'rb') as f:
+        data = f.read()
+    
+    if metadata_file.endswith(".jsonl"):
+        # One entry per line; a later line for the same doc_id wins
+        all_metadata = {}
+        for line in data.splitlines():
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # Blank, or torn by a crash mid-append
+                continue
+            all_metadata[entry["doc_id"]] = entry
+    else:
+        all_metadata = orjson.loads(data)
+    
+    documents_json = orjson.dumps(list(all_metadata.values()))
+    _metadata_cache.set(metadata_file, (stamp, all_metadata, documents_json))
+    return all_metadata, documents_json
+
+
+def _read_metadata_file(metadata_file: str) -> Dict[str, Any]:
+    """Load a session's metadata keyed by doc_id (shared and cached, do not mutate)"""
+    return _load_metadata_file(metadata_file)[0]
+
+
+def _write_atomic(path: str, payload: bytes) -> None:
+    """Write to a temporary sibling and swap it into place so readers never see a partial file"""
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Read-modify-write of a session's files is serialized by one of a fixed set of locks
+# (chosen by session directory), so memory stays bounded however many sessions exist
+_SESSION_LOCKS = tuple(threading.Lock() for _ in range(64))
+
+
+def _session_lock(session_dir: str) -> threading.Lock:
+    """The lock guarding read-modify-write of files in `session_dir`"""
+    return _SESSION_LOCKS[hash(session_dir) % len(_SESSION_LOCKS)]
+
+
+def _write_metadata_line(metadata_file: str, entry: Dict[str, Any]) -> str:
+    """Append one metadata line to `metadata_file`"""
+    # One appended line per change instead of rewriting the whole file; a single
+    # write of the complete line keeps concurrent uploads from interleaving
+    line = orjson.dumps(entry) + b"\n"
+    with open(metadata_file, 'a+b') as f:
+        # Start on a fresh line if a crash left a torn line at the end, so it can't swallow this one
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+    return metadata_file
+
+
+def _append_metadata_locked(session_dir: str, entry: Dict[str, Any]) -> str:
+    """Append one document's metadata line; the caller holds _session_lock(session_dir)"""
+    metadata_file = os.path.join(session_dir, "metadata.jsonl")
+    
+    # Carry over a legacy metadata.json the first time the session is written
+    if not os.path.exists(metadata_file):
+        legacy_metadata = _read_metadata_file(os.path.join(session_dir, "metadata.json"))
+        if legacy_metadata:
+            _write_atomic(
+                metadata_file,
+                b"".join(orjson.dumps(legacy) + b"\n" for legacy in legacy_metadata.values())
+            )
+    
+    return _write_metadata_line(metadata_file, entry)
+
+
+def _append_metadata(session_dir: str, entry: Dict[str, Any]) -> str:
+    """Append one document's metadata line to the session's metadata.jsonl"""
+    metadata_file = os.path.join(session_dir, "metadata.jsonl")
+    if os.path.exists(metadata_file):
+        return _write_metadata_line(metadata_file, entry)
+    
+    # The first write may migrate a legacy metadata.json, which must happen only once
+    with _session_lock(session_dir):
+        return _append_metadata_locked(session_dir, entry)
+
+
+# OCR and analysis JSON is stored gzip-compressed; low levels already shrink text JSON
+# several times over at a fraction of the CPU cost of the default level
+_GZIP_LEVEL = 3
+
+
+def _write_json_gz_atomic(path: str, data: Any) -> None:
+    """Atomically write gzip-compressed compact JSON"""
+    payload = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    _write_atomic(path, gzip.compress(payload, compresslevel=_GZIP_LEVEL, mtime=0))
+
+
+def _read_json_file(path: str) -> Any:
+    """Read a JSON file, decompressing it if it is gzip-compressed (.gz)"""
+    with open(path, 'rb') as f:
+        payload = f.read()
+    if path.endswith(".gz"):
+        payload = gzip.decompress(payload)
+    return orjson.loads(payload)
+
+
+def _stored_json_file(session_dir: str, name: str) -> str:
+    """Path of a stored `name` JSON file: name.gz, or the uncompressed name written before compression"""
+    compressed_file = os.path.join(session_dir, f"{name}.gz")
+    legacy_file = os.path.join(session_dir, name)
+    if not os.path.exists(compressed_file) and os.path.exists(legacy_file):
+        return legacy_file
+    return compressed_file
 
 
 class DocumentStorage:
@@ -26,10 +199,12 @@ class DocumentStorage:
         file_path: str, 
         user_id: str, 
         session_uid: str, 
-        original_filename: str
+        original_filename: str,
+        move: bool = False
     ) -> Tuple[str, str]:
         """
         Save uploaded file to user's session directory
+        (move=True renames it into place rather than copying, consuming the source)
         Returns: (doc_id, saved_file_path)
         """
         doc_id = DocumentStorage.generate_document_id()
@@ -45,8 +220,15 @@ class DocumentStorage:
         new_filename = f"{doc_id}.{file_extension}"
         destination_path = os.path.join(session_dir, new_filename)
         
-        # Copy file to destination
-        shutil.copy2(file_path, destination_path)
+        # Move (a metadata-only rename on the same filesystem) or copy file to destination
+        if move:
+            try:
+                os.replace(file_path, destination_path)
+            except OSError:
+                shutil.copy2(file_path, destination_path)
+                os.unlink(file_path)
+        else:
+            shutil.copy2(file_path, destination_path)
         
         return doc_id, destination_path
     
@@ -56,32 +238,51 @@ class DocumentStorage:
         session_uid: str, 
         doc_id: str, 
         metadata: Dict[str, Any],
-        original_filename: str
+        original_filename: str,
+        stored_filename: Optional[str] = None,
+        content_digest: Optional[str] = None
     ) -> str:
-        """Save document metadata to metadata.json"""
-        session_dir = get_session_path(user_id, session_uid)
-        metadata_file = os.path.join(session_dir, "metadata.json")
-        
-        # Load existing metadata or create new
-        if os.path.exists(metadata_file):
-            with open(metadata_file, 'r') as f:
-                all_metadata = json.load(f)
-        else:
-            all_metadata = {}
-        
-        # Add new document metadata
-        all_metadata[doc_id] = {
+        """
+        Append document metadata to metadata.jsonl
+        (stored_filename, the saved file's name, lets get_document_path skip a directory scan;
+        content_digest, the file's content hash, lets find_document_by_digest spot re-uploads)
+        """
+        entry = {
             "doc_id": doc_id,
             "original_filename": original_filename,
             "uploaded_at": datetime.utcnow().isoformat(),
             "metadata": metadata
         }
-        
-        # Save updated metadata
-        with open(metadata_file, 'w') as f:
-            json.dump(all_metadata, f, indent=2)
-        
-        return metadata_file
+        if stored_filename:
+            entry["stored_filename"] = stored_filename
+        if content_digest:
+            entry["content_digest"] = content_digest
+        return _append_metadata(get_session_path(user_id, session_uid), entry)
+    
+    @staticmethod
+    def update_metadata(
+        user_id: str, 
+        session_uid: str, 
+        doc_id: str, 
+        updates: Dict[str, Any]
+    ) -> bool:
+        """Merge `updates` into a saved document's metadata (False if the document is unknown)"""
+        session_dir = get_session_path(user_id, session_uid)
+        # Locked so concurrent updates to one document each build on the other's line
+        with _session_lock(session_dir):
+            entry = _read_metadata_file(_session_metadata_file(session_dir)).get(doc_id)
+            if entry is None:
+                return False
+            
+            _append_metadata_locked(session_dir, {**entry, "metadata": {**entry["metadata"], **updates}})
+        return True
+    
+    @staticmethod
+    def save_document_text(user_id: str, session_uid: str, doc_id: str, text: str) -> str:
+        """Save parsed document text to {doc_id}_text.txt so later reads never re-parse"""
+        text_file = os.path.join(get_session_path(user_id, session_uid), f"{doc_id}_text.txt")
+        _write_atomic(text_file, text.encode())
+        return text_file
     
     @staticmethod
     def save_ocr_results(
@@ -91,9 +292,9 @@ class DocumentStorage:
         ocr_text: str,
         ocr_data: Optional[Dict[str, Any]] = None
     ) -> str:
-        """Save OCR results to {doc_id}_ocr.json"""
+        """Save OCR results to {doc_id}_ocr.json.gz"""
         session_dir = get_session_path(user_id, session_uid)
-        ocr_file = os.path.join(session_dir, f"{doc_id}_ocr.json")
+        ocr_file = os.path.join(session_dir, f"{doc_id}_ocr.json.gz")
         
         ocr_results = {
             "doc_id": doc_id,
@@ -102,8 +303,8 @@ class DocumentStorage:
             "processed_at": datetime.utcnow().isoformat()
         }
         
-        with open(ocr_file, 'w') as f:
-            json.dump(ocr_results, f, indent=2)
+        _write_json_gz_atomic(ocr_file, ocr_results)
+        _document_text_cache.set((user_id, session_uid, doc_id), (_file_stamp(ocr_file), ocr_text))
         
         return ocr_file
     
@@ -113,26 +314,24 @@ class DocumentStorage:
         session_uid: str, 
         analysis_data: Dict[str, Any]
     ) -> str:
-        """Save AI analysis results to analysis.json"""
+        """Save AI analysis results to analysis.json.gz"""
         session_dir = get_session_path(user_id, session_uid)
-        analysis_file = os.path.join(session_dir, "analysis.json")
-        
-        # Load existing analysis or create new
-        if os.path.exists(analysis_file):
-            with open(analysis_file, 'r') as f:
-                all_analysis = json.load(f)
-        else:
-            all_analysis = {}
+        analysis_file = os.path.join(session_dir, "analysis.json.gz")
         
-        doc_id = analysis_data.get("doc_id")
-        if doc_id:
-            all_analysis[doc_id] = {
-                **analysis_data,
-                "analyzed_at": datetime.utcnow().isoformat()
-            }
-        
-        with open(analysis_file, 'w') as f:
-            json.dump(all_analysis, f, indent=2)
+        # Locked so concurrent analyses in a session don't drop each other's results
+        with _session_lock(session_dir):
+            # Load existing analysis (possibly from a legacy analysis.json) or create new
+            existing_file = _stored_json_file(session_dir, "analysis.json")
+            all_analysis = _read_json_file(existing_file) if os.path.exists(existing_file) else {}
+            
+            doc_id = analysis_data.get("doc_id")
+            if doc_id:
+                all_analysis[doc_id] = {
+                    **analysis_data,
+                    "analyzed_at": datetime.utcnow().isoformat()
+                }
+            
+            _write_json_gz_atomic(analysis_file, all_analysis)
         
         return analysis_file
     
@@ -141,47 +340,133 @@ class DocumentStorage:
         """Get the full path to a document file"""
         session_dir = get_session_path(user_id, session_uid)
         
-        # Look for file with doc_id prefix
+        # Documents saved with their stored filename resolve without listing the directory
+        entry = _read_metadata_file(_session_metadata_file(session_dir)).get(doc_id)
+        if entry and entry.get("stored_filename"):
+            doc_path = os.path.join(session_dir, entry["stored_filename"])
+            return doc_path if os.path.isfile(doc_path) else None
+        
+        # Look for the file named {doc_id}.{extension} (not e.g. {doc_id}_ocr.json)
         if os.path.exists(session_dir):
-            for filename in os.listdir(session_dir):
-                if filename.startswith(doc_id) and '.' in filename:
-                    return os.path.join(session_dir, filename)
+            with os.scandir(session_dir) as entries:
+                for dir_entry in entries:
+                    if dir_entry.name.startswith(f"{doc_id}."):
+                        return dir_entry.path
         
         return None
     
+    @staticmethod
+    def list_documents(user_id: str, session_uid: str) -> List[Dict[str, Any]]:
+        """List metadata for all documents in a session"""
+        metadata_file = _session_metadata_file(get_session_path(user_id, session_uid))
+        return list(_read_metadata_file(metadata_file).values())
+    
+    @staticmethod
+    def list_documents_json(user_id: str, session_uid: str) -> bytes:
+        """list_documents as JSON bytes, serialized once per metadata change"""
+        metadata_file = _session_metadata_file(get_session_path(user_id, session_uid))
+        return _load_metadata_file(metadata_file)[1]
+    
     @staticmethod
     def get_document_metadata(user_id: str, session_uid: str, doc_id: str) -> Optional[Dict[str, Any]]:
         """Get metadata for a specific document"""
-        session_dir = get_session_path(user_id, session_uid)
-        metadata_file = os.path.join(session_dir, "metadata.json")
-        
-        if os.path.exists(metadata_file):
-            with open(metadata_file, 'r') as f:
-                all_metadata = json.load(f)
-                return all_metadata.get(doc_id)
-        
+        metadata_file = _session_metadata_file(get_session_path(user_id, session_uid))
+        return _read_metadata_file(metadata_file).get(doc_id)
+    
+    @staticmethod
+    def find_document_by_digest(
+        user_id: str, 
+        session_uid: str, 
+        content_digest: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Get metadata for the session's document with this content hash, if its file still exists
+        and it can stand in for a re-upload: it needs no OCR, or its OCR completed or is still
+        running. Documents whose OCR failed or was abandoned are skipped, so re-uploading retries OCR.
+        """
+        metadata_file = _session_metadata_file(get_session_path(user_id, session_uid))
+        for entry in _read_metadata_file(metadata_file).values():
+            if entry.get("content_digest") == content_digest and DocumentStorage._is_reusable(entry):
+                if DocumentStorage.get_document_path(user_id, session_uid, entry["doc_id"]):
+                    return entry
         return None
     
+    @staticmethod
+    def _is_reusable(entry: Dict[str, Any]) -> bool:
+        """Whether a stored document reached (or is still on its way to) a usable text"""
+        metadata = entry.get("metadata", {})
+        if not metadata.get("needs_ocr"):
+            return True
+        ocr_status = metadata.get("ocr_status")
+        return ocr_status == "completed" or (
+            ocr_status == "processing" and not DocumentStorage.is_ocr_abandoned(entry)
+        )
+    
+    @staticmethod
+    def is_ocr_abandoned(entry: Dict[str, Any]) -> bool:
+        """A restart drops in-flight background OCR; treat it as abandoned after the timeout"""
+        started_at = datetime.fromisoformat(entry["uploaded_at"])
+        return datetime.utcnow() - started_at >= timedelta(seconds=config.OCR_BACKGROUND_TIMEOUT_SECONDS)
+    
     @staticmethod
     def get_document_text(user_id: str, session_uid: str, doc_id: str) -> Optional[str]:
         """Get document text (from original parse or OCR)"""
+        cache_key = (user_id, session_uid, doc_id)
+        ocr_file = _stored_json_file(get_session_path(user_id, session_uid), f"{doc_id}_ocr.json")
+        # One stat keeps cached text from outliving an OCR file rewritten by another worker
+        stamp = _file_stamp(ocr_file)
+        cached = _document_text_cache.get(cache_key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        
+        text = DocumentStorage._load_document_text(user_id, session_uid, doc_id)
+        if text is not None:
+            _document_text_cache.set(cache_key, (stamp, text))
+        return text
+    
+    @staticmethod
+    def get_word_count(user_id: str, session_uid: str, doc_id: str, text: str) -> int:
+        """Word count of a document's current text (as from get_document_text), counted once per OCR file version"""
+        cache_key = (user_id, session_uid, doc_id)
+        ocr_file = _stored_json_file(get_session_path(user_id, session_uid), f"{doc_id}_ocr.json")
+        stamp = _file_stamp(ocr_file)
+        cached = _word_count_cache.get(cache_key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        
+        from documents.parser import DocumentParser
+        word_count = DocumentParser.count_words(text)
+        _word_count_cache.set(cache_key, (stamp, word_count))
+        return word_count
+    
+    @staticmethod
+    def _load_document_text(user_id: str, session_uid: str, doc_id: str) -> Optional[str]:
+        """Read document text from the stored OCR results or parsed text, or re-parse the original file"""
         # First try to get OCR text
         session_dir = get_session_path(user_id, session_uid)
-        ocr_file = os.path.join(session_dir, f"{doc_id}_ocr.json")
+        ocr_file = _stored_json_file(session_dir, f"{doc_id}_ocr.json")
         
         if os.path.exists(ocr_file):
-            with open(ocr_file, 'r') as f:
-                ocr_data = json.load(f)
-                return ocr_data.get("ocr_text", "")
+            return _read_json_file(ocr_file).get("ocr_text", "")
+        
+        # Then the text saved when the document was parsed
+        text_file = os.path.join(session_dir, f"{doc_id}_text.txt")
+        try:
+            with open(text_file, 'rb') as f:
+                return f.read().decode()
+        except FileNotFoundError:
+            pass
         
-        # If no OCR file, try to parse the document again
+        # Otherwise (documents uploaded before parsed text was saved) parse it again, once
         doc_path = DocumentStorage.get_document_path(user_id, session_uid, doc_id)
         if doc_path:
             from documents.parser import DocumentParser
             try:
                 text_content, _, _ = DocumentParser.parse_document(doc_path)
-                return text_content
             except Exception:
                 return None
+            if text_content:
+                DocumentStorage.save_document_text(user_id, session_uid, doc_id, text_content)
+            return text_content
         
         return None
\ No newline at end of file
@@ -4,14 +4,13 @@ Provides user authentication, document handling, and AI-powered analysis.
 """
 
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
 
 # Rate limiting imports
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
 
@@ -21,22 +20,15 @@ load_dotenv()
 from auth.routes import auth_router
 from documents.routes import documents_router
 from config import config
+from utils.middleware import MaxBodySizeMiddleware
+from utils.rate_limit import limiter, rate_limit_exceeded_handler
 
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize app data directories on startup"""
     os.makedirs("data/system", exist_ok=True)
-    
-    # Initialize users.json if it doesn't exist
-    users_file = "data/system/users.json"
-    if not os.path.exists(users_file):
-        import json
-        with open(users_file, 'w') as f:
-            json.dump({}, f)
+    # The users database (and its schema) is created on first use by auth.utils
     
     yield
 
@@ -45,14 +37,18 @@ app = FastAPI(
     title="DocuMint Backend API",
     description="Backend API for document analysis and AI-powered insights",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse  # orjson for every route, not just the documents router
 )
 
 # Add rate limiting middleware
 app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
 app.add_middleware(SlowAPIMiddleware)
 
+# Reject oversized bodies before they are read (inside CORS so 413s stay readable cross-origin)
+app.add_middleware(MaxBodySizeMiddleware, max_body_size=config.MAX_REQUEST_SIZE)
+
 # CORS middleware for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -60,6 +56,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=config.CORS_MAX_AGE,
 )
 
 # Health check endpoint (no rate limiting for health checks)
@@ -6,12 +6,9 @@ import asyncio
 import json
 from ai.dynamic_gemini_client import DynamicGeminiClient
 
-async def test_dynamic_workflow():
-    try:
-        client = DynamicGeminiClient()
-        
-        # Sample NDA document
-        sample_nda = """
+# Sample documents by test document ID
+SAMPLE_DOCUMENTS = {
+    "test-nda-001": """
         MUTUAL NON-DISCLOSURE AGREEMENT
         
         This Mutual Non-Disclosure Agreement ("Agreement") is entered into on January 15, 2024, 
@@ -43,49 +40,62 @@ async def test_dynamic_workflow():
         6. GOVERNING LAW
         This Agreement shall be governed by the laws of Delaware.
         """
+}
+
+def print_result(result):
+    """Print one analysis result"""
+    print("ANALYSIS RESULTS:")
+    print(f"Document ID: {result['doc_id']}")
+    print(f"Analysis Method: {result.get('analysis_method', 'unknown')}")
+    print(f"Total Insights: {len(result['insights'])}")
+    
+    if 'document_analysis' in result:
+        doc_analysis = result['document_analysis']
+        print(f"\nDOCUMENT TYPE ANALYSIS:")
+        if 'document_type' in doc_analysis:
+            dt = doc_analysis['document_type']
+            print(f"  Type: {dt.get('document_type', 'Unknown')}")
+            print(f"  Category: {dt.get('category', 'Unknown')}")
+            print(f"  Confidence: {dt.get('confidence', 'Unknown')}")
+        
+        print(f"  Generic Insights: {doc_analysis.get('generic_insights_count', 0)}")
+        print(f"  Specific Insights: {doc_analysis.get('specific_insights_count', 0)}")
+    
+    print(f"\nINSIGHTS BREAKDOWN:")
+    insight_types = {}
+    intensity_counts = {}
+    
+    for i, insight in enumerate(result['insights'], 1):
+        insight_type = insight.get('type_of_insight', 'unknown')
+        intensity = insight.get('intensity', 'unknown')
+        
+        insight_types[insight_type] = insight_types.get(insight_type, 0) + 1
+        intensity_counts[intensity] = intensity_counts.get(intensity, 0) + 1
+        
+        print(f"\n  {i}. [{insight_type.upper()}] [{intensity.upper()}]")
+        print(f"     {insight.get('description', 'No description')}")
+        if insight.get('recommendation'):
+            print(f"     → {insight['recommendation']}")
+    
+    print(f"\nSUMMARY STATISTICS:")
+    print(f"  Types: {dict(insight_types)}")
+    print(f"  Intensities: {dict(intensity_counts)}")
+
+async def test_dynamic_workflow():
+    try:
+        client = DynamicGeminiClient()
         
-        print("Testing dynamic workflow with sample NDA...")
+        print(f"Testing dynamic workflow with {len(SAMPLE_DOCUMENTS)} sample document(s)...")
         print("=" * 60)
         
-        # Run dynamic analysis
-        result = await client.analyze_document_dynamic("test-nda-001", sample_nda)
-        
-        print("ANALYSIS RESULTS:")
-        print(f"Document ID: {result['doc_id']}")
-        print(f"Analysis Method: {result.get('analysis_method', 'unknown')}")
-        print(f"Total Insights: {len(result['insights'])}")
-        
-        if 'document_analysis' in result:
-            doc_analysis = result['document_analysis']
-            print(f"\nDOCUMENT TYPE ANALYSIS:")
-            if 'document_type' in doc_analysis:
-                dt = doc_analysis['document_type']
-                print(f"  Type: {dt.get('document_type', 'Unknown')}")
-                print(f"  Category: {dt.get('category', 'Unknown')}")
-                print(f"  Confidence: {dt.get('confidence', 'Unknown')}")
-            
-            print(f"  Generic Insights: {doc_analysis.get('generic_insights_count', 0)}")
-            print(f"  Specific Insights: {doc_analysis.get('specific_insights_count', 0)}")
-        
-        print(f"\nINSIGHTS BREAKDOWN:")
-        insight_types = {}
-        intensity_counts = {}
-        
-        for i, insight in enumerate(result['insights'], 1):
-            insight_type = insight.get('type_of_insight', 'unknown')
-            intensity = insight.get('intensity', 'unknown')
-            
-            insight_types[insight_type] = insight_types.get(insight_type, 0) + 1
-            intensity_counts[intensity] = intensity_counts.get(intensity, 0) + 1
-            
-            print(f"\n  {i}. [{insight_type.upper()}] [{intensity.upper()}]")
-            print(f"     {insight.get('description', 'No description')}")
-            if insight.get('recommendation'):
-                print(f"     → {insight['recommendation']}")
+        # Run all dynamic analyses at once; the client bounds concurrent Gemini requests
+        results = await asyncio.gather(*(
+            client.analyze_document_dynamic(doc_id, document_text)
+            for doc_id, document_text in SAMPLE_DOCUMENTS.items()
+        ))
         
-        print(f"\nSUMMARY STATISTICS:")
-        print(f"  Types: {dict(insight_types)}")
-        print(f"  Intensities: {dict(intensity_counts)}")
+        for result in results:
+            print_result(result)
         
         print("\n" + "=" * 60)
         print("DYNAMIC WORKFLOW TEST COMPLETED SUCCESSFULLY!")
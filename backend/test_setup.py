@@ -8,6 +8,9 @@ import os
 # Add the backend directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+# The minimum bcrypt cost keeps the hashing checks fast (read by config at import)
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
 def test_imports():
     """Test that all modules can be imported"""
     print("Testing imports...")
@@ -99,6 +102,24 @@ def test_document_parser():
         else:
             print(f"✗ File validation failed: {msg}")
             return False
+        
+        # Test content sniffing: a mis-named file is rejected, a real header passes
+        import tempfile
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fake_pdf = os.path.join(temp_dir, "fake.pdf")
+            with open(fake_pdf, "wb") as f:
+                f.write(b"<html>not a pdf</html>")
+            real_pdf = os.path.join(temp_dir, "real.pdf")
+            with open(real_pdf, "wb") as f:
+                f.write(b"%PDF-1.7\n")
+            
+            fake_valid, _ = DocumentParser.validate_file(fake_pdf)
+            real_valid, _ = DocumentParser.validate_file(real_pdf)
+            if not fake_valid and real_valid:
+                print("✓ File validation checks the file header")
+            else:
+                print("✗ File header validation failed")
+                return False
             
     except Exception as e:
         print(f"✗ Document parser test failed: {e}")
@@ -106,6 +127,170 @@ def test_document_parser():
     
     return True
 
+def test_storage_legacy_metadata_update():
+    """Test updating a document in a session that only has a legacy metadata.json"""
+    print("\nTesting legacy metadata update...")
+    
+    try:
+        import json
+        import tempfile
+        import threading
+        import documents.storage as storage
+        
+        session_dir = tempfile.mkdtemp()
+        with open(os.path.join(session_dir, "metadata.json"), "w") as f:
+            json.dump({"doc-1": {"doc_id": "doc-1", "metadata": {"ocr_status": "processing"}}}, f)
+        
+        original_get_session_path = storage.get_session_path
+        storage.get_session_path = lambda user_id, session_uid: session_dir
+        try:
+            # Run in a thread so a lock re-entry shows up as a timeout instead of a hang
+            result = []
+            worker = threading.Thread(
+                target=lambda: result.append(storage.DocumentStorage.update_metadata(
+                    "user", "session", "doc-1", {"ocr_status": "completed"}
+                )),
+                daemon=True
+            )
+            worker.start()
+            worker.join(timeout=5)
+            if worker.is_alive():
+                print("✗ update_metadata deadlocked on a legacy session")
+                return False
+            
+            entry = storage.DocumentStorage.get_document_metadata("user", "session", "doc-1")
+        finally:
+            storage.get_session_path = original_get_session_path
+        
+        if result == [True] and entry["metadata"]["ocr_status"] == "completed":
+            print("✓ Legacy metadata is migrated and updated")
+        else:
+            print(f"✗ Legacy metadata update failed: {result}, {entry}")
+            return False
+            
+    except Exception as e:
+        print(f"✗ Legacy metadata update test failed: {e}")
+        return False
+    
+    return True
+
+def test_reupload_after_failed_ocr():
+    """Test that re-uploading a document whose OCR failed is not deduplicated"""
+    print("\nTesting re-upload after failed OCR...")
+    
+    try:
+        import tempfile
+        import documents.storage as storage
+        
+        session_dir = tempfile.mkdtemp()
+        original_get_session_path = storage.get_session_path
+        storage.get_session_path = lambda user_id, session_uid: session_dir
+        try:
+            DocumentStorage = storage.DocumentStorage
+            with open(os.path.join(session_dir, "doc-1.png"), "wb") as f:
+                f.write(b"\x89PNG")
+            DocumentStorage.save_metadata(
+                "user", "session", "doc-1", {"needs_ocr": True, "ocr_status": "processing"},
+                "scan.png", "doc-1.png", "digest-1"
+            )
+            if not DocumentStorage.find_document_by_digest("user", "session", "digest-1"):
+                print("✗ A document with OCR in progress was not reused")
+                return False
+            
+            DocumentStorage.update_metadata("user", "session", "doc-1", {"ocr_status": "failed"})
+            if DocumentStorage.find_document_by_digest("user", "session", "digest-1") is None:
+                print("✓ A document whose OCR failed is uploaded afresh")
+            else:
+                print("✗ Re-upload after failed OCR returned the failed document")
+                return False
+            
+            DocumentStorage.update_metadata("user", "session", "doc-1", {"ocr_status": "completed"})
+            if DocumentStorage.find_document_by_digest("user", "session", "digest-1"):
+                print("✓ A document whose OCR completed is reused")
+            else:
+                print("✗ A document whose OCR completed was not reused")
+                return False
+        finally:
+            storage.get_session_path = original_get_session_path
+            
+    except Exception as e:
+        print(f"✗ Re-upload test failed: {e}")
+        return False
+    
+    return True
+
+def test_insight_parser():
+    """Test insight parsing of structured text responses"""
+    print("\nTesting insight parser...")
+    
+    try:
+        from ai.text_parser import InsightTextParser
+        
+        parser = InsightTextParser()
+        
+        # Well-formed blocks mixed with one missing its INTENSITY line
+        response_text = (
+            "RISK: Unlimited liability for the supplier\n"
+            "INTENSITY: High\n"
+            "RECOMMENDATION: Cap liability at the contract value\n"
+            "\n"
+            "RISK: Automatic renewal without notice\n"
+            "RECOMMENDATION: Require written notice before renewal\n"
+            "\n"
+            "RISK: No termination for convenience\n"
+            "INTENSITY: Medium\n"
+            "RECOMMENDATION: Add a 30-day termination clause\n"
+        )
+        insights = parser.parse_insights_from_text(response_text, 'suggestion')
+        if len(insights) == 3 and all(insight.type == 'risk' for insight in insights):
+            print("✓ Malformed blocks are parsed alongside well-formed ones")
+        else:
+            print(f"✗ Mixed block parsing failed: got {len(insights)} insights")
+            return False
+        
+        # Nested emphasis is unwrapped completely
+        cleaned = [parser._clean_markdown(text) for text in ("**_term_**", "_**term**_", "*a **b** c*")]
+        if cleaned == ["term", "term", "a b c"]:
+            print("✓ Nested markdown emphasis is stripped")
+        else:
+            print(f"✗ Markdown cleanup failed: got {cleaned}")
+            return False
+            
+    except Exception as e:
+        print(f"✗ Insight parser test failed: {e}")
+        return False
+    
+    return True
+
+def test_semantic_cache():
+    """Test semantic cache matching over chunked document embeddings"""
+    print("\nTesting semantic cache...")
+    
+    try:
+        from ai.response_cache import SemanticCache
+        
+        cache = SemanticCache(threshold=0.95)
+        cache.add([[1.0, 0.0], [0.0, 1.0]], "template contract A")
+        
+        if cache.lookup([[1.0, 0.0], [0.0, 1.0]]) == "template contract A":
+            print("✓ Identical chunk embeddings hit the cache")
+        else:
+            print("✗ Identical chunk embeddings missed the cache")
+            return False
+        
+        # Same opening chunk, different later terms
+        if cache.lookup([[1.0, 0.0], [1.0, 0.0]]) is None and cache.lookup([[1.0, 0.0]]) is None:
+            print("✓ Documents differing after the first chunk do not collide")
+        else:
+            print("✗ Documents sharing only an opening chunk collided")
+            return False
+            
+    except Exception as e:
+        print(f"✗ Semantic cache test failed: {e}")
+        return False
+    
+    return True
+
 def test_prompts():
     """Test prompt generation"""
     print("\nTesting prompt generation...")
@@ -148,6 +333,10 @@ def main():
         test_imports,
         test_auth_utils,
         test_document_parser,
+        test_storage_legacy_metadata_update,
+        test_reupload_after_failed_ocr,
+        test_insight_parser,
+        test_semantic_cache,
         test_prompts
     ]
     
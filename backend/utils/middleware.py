@@ -0,0 +1,79 @@
+"""
+ASGI middleware shared by the API
+"""
+
+import orjson
+from fastapi import HTTPException, status
+
+
+class _BodyTooLarge(HTTPException):
+    """
+    Raised from the wrapped receive channel once a request body passes the limit;
+    an HTTPException so FastAPI's body parsing re-raises it as a 413 instead of a 400
+    """
+
+    def __init__(self, max_body_size: int):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Request too large. Maximum size is {max_body_size} bytes"
+        )
+
+
+class MaxBodySizeMiddleware:
+    """
+    Reject request bodies over `max_body_size` bytes with 413, from the Content-Length
+    header when present and otherwise as soon as the streamed body crosses the limit
+    """
+
+    def __init__(self, app, max_body_size: int):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if not value.isdigit() or int(value) > self.max_body_size:
+                    await self._reject(send)
+                    return
+                break
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    raise _BodyTooLarge(self.max_body_size)
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except _BodyTooLarge:
+            # Body read outside a route's exception handling
+            if not response_started:
+                await self._reject(send)
+
+    async def _reject(self, send):
+        body = orjson.dumps({"detail": _BodyTooLarge(self.max_body_size).detail})
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
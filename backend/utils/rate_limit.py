@@ -0,0 +1,50 @@
+"""
+Shared request rate limiter (counters kept in Redis when configured)
+"""
+
+import math
+import time
+
+from fastapi import Request, status
+from fastapi.responses import ORJSONResponse
+from slowapi import Limiter
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
+
+from config import config
+from utils.response import error_response
+
+# One limiter for every router so all workers count against the same Redis keys;
+# if Redis is unreachable each worker falls back to its own in-memory counters
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=config.REDIS_URL or "memory://",
+    strategy="fixed-window",
+    key_prefix="ratelimit",
+    in_memory_fallback_enabled=True
+)
+
+
+def _retry_after_seconds(request: Request, exc: RateLimitExceeded) -> int:
+    """Seconds until the exceeded limit's window resets (the whole window if unknown)"""
+    current_limit = getattr(request.state, "view_rate_limit", None)
+    if current_limit is not None:
+        try:
+            reset_at, _ = limiter.limiter.get_window_stats(current_limit[0], *current_limit[1])
+            return max(1, math.ceil(reset_at - time.time()))
+        except Exception:
+            pass
+    return exc.limit.limit.get_expiry()
+
+
+def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded) -> ORJSONResponse:
+    """Return a structured 429 with the number of seconds to wait before retrying"""
+    retry_after = _retry_after_seconds(request, exc)
+    return ORJSONResponse(
+        {
+            **error_response(f"Rate limit exceeded: {exc.detail}", "Too many requests"),
+            "retry_after": retry_after
+        },
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(retry_after)}
+    )
@@ -3,6 +3,7 @@ Standardized API response utilities
 """
 
 from typing import Any, Dict, Optional
+import orjson
 from pydantic import BaseModel
 
 
@@ -23,6 +24,11 @@ def success_response(data: Any = None, message: str = "Success") -> Dict[str, An
     }
 
 
+def success_response_bytes(data_json: bytes, message: str = "Success") -> bytes:
+    """Create a serialized successful response around already-serialized JSON data"""
+    return b'{"success":true,"data":' + data_json + b',"message":' + orjson.dumps(message) + b'}'
+
+
 def error_response(error: str, message: str = "Error occurred") -> Dict[str, Any]:
     """Create an error response"""
     return {
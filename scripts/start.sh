@@ -6,6 +6,9 @@ echo "Starting DocuMint AI services..."
 # Set default values for Cloud Run
 export PORT=${PORT:-8080}
 export BACKEND_PORT=${BACKEND_PORT:-8000}
+# Parsing and OCR already run in worker pools; extra uvicorn workers each bring their own
+# pools, in-process caches and rate-limit counters, so size CPU_WORKER_PROCESSES to match
+export BACKEND_WORKERS=${BACKEND_WORKERS:-1}
 
 # Create environment files from Cloud Run environment variables
 echo "Setting up environment configuration..."
@@ -66,7 +69,7 @@ mkdir -p /app/backend/data/system
 # Start backend service
 echo "Starting FastAPI backend on port $BACKEND_PORT..."
 cd /app/backend
-uvicorn main:app --host 0.0.0.0 --port $BACKEND_PORT --workers 1 &
+uvicorn main:app --host 0.0.0.0 --port $BACKEND_PORT --workers $BACKEND_WORKERS &
 BACKEND_PID=$!
 
 # Wait for backend to be ready